@@ -0,0 +1,149 @@
+"""Download throughput benchmark: legacy base64 DOWNLOAD vs sendfile DOWNLOAD_STREAM.
+
+Starts server.py in a scratch directory, uploads one file and downloads it
+repeatedly over both paths, reporting MB/s and server CPU seconds per path.
+
+    python bench_download.py --size-mb 32 --rounds 5 --engine threaded
+
+Files over file_transfer.MAX_BASE64_FILE_SIZE (about 48 MiB) are only
+downloaded as a stream: the server refuses the legacy DOWNLOAD for them.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from file_transfer import iter_file_frames, MAX_BASE64_FILE_SIZE
+from network_utils import SocketBuffer, payload_length
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+
+def start_server(engine, port, extra_args=(), files=None):
+    """Run server.py in a temp dir; returns (process, workdir).
+
+    files: {name: text} written to the temp dir first (e.g. a users.json).
+    """
+    workdir = tempfile.mkdtemp(prefix='nethub-bench-')
+    for name, text in (files or {}).items():
+        with open(os.path.join(workdir, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+    proc = subprocess.Popen([sys.executable, SERVER_SCRIPT, '--engine', engine, '--port', str(port), *extra_args],
+                            cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc, workdir
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+
+def stop_server(proc, workdir):
+    proc.terminate()
+    proc.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def server_cpu_seconds(pid):
+    # utime + stime from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def login(port, username, room):
+    sock = socket.create_connection(('127.0.0.1', port))
+    reader = SocketBuffer(sock)
+    sock.sendall(f"REGISTER|{username}|bench\n".encode('utf-8'))
+    reader.read_line()
+    sock.sendall(f"LOGIN|{username}|bench\nJOIN_ROOM|{room}\n".encode('utf-8'))
+    while not reader.read_line().startswith("ROOM_JOINED"):
+        pass
+    return sock, reader
+
+
+def wait_for(reader, prefix):
+    while True:
+        line = reader.read_line()
+        if line.startswith(prefix):
+            return line
+
+
+def download_legacy(sock, reader, filename):
+    sock.sendall(f"DOWNLOAD|{filename}\n".encode('utf-8'))
+    line = wait_for(reader, "FILE_DATA|")
+    return len(line.rsplit('|', 1)[1]) * 3 // 4
+
+
+def download_stream(sock, reader, filename):
+    sock.sendall(f"DOWNLOAD_STREAM|{filename}\n".encode('utf-8'))
+    wait_for(reader, "FILE_START|")
+    received = 0
+    while True:
+        line = reader.read_line()
+        length = payload_length(line)
+        if length is not None:
+            received += len(reader.read_exact(length))
+        elif line.startswith("FILE_END|"):
+            return received
+
+
+def run(args):
+    proc, workdir = start_server(args.engine, args.port)
+    try:
+        sock, reader = login(args.port, "bench", "bench-room")
+        src = os.path.join(workdir, 'payload.bin')
+        with open(src, 'wb') as f:
+            f.write(os.urandom(args.size_mb * 1024 * 1024))
+        for frame in iter_file_frames(src, 'payload.bin', 'UPLOAD'):
+            sock.sendall(frame)
+        wait_for(reader, "UPLOAD_OK|")
+
+        results = {'engine': args.engine, 'size_mb': args.size_mb, 'rounds': args.rounds}
+        paths = [('sendfile_stream', download_stream)]
+        if os.path.getsize(src) <= MAX_BASE64_FILE_SIZE:
+            paths.insert(0, ('legacy_base64', download_legacy))
+        else:
+            results['legacy_base64'] = None
+        for name, fn in paths:
+            cpu_before = server_cpu_seconds(proc.pid)
+            start = time.perf_counter()
+            total = 0
+            for _ in range(args.rounds):
+                total += fn(sock, reader, 'payload.bin')
+            elapsed = time.perf_counter() - start
+            cpu_after = server_cpu_seconds(proc.pid)
+            results[name] = {
+                'seconds': round(elapsed, 3),
+                'mb_per_s': round(total / (1024 * 1024) / elapsed, 1),
+                'server_cpu_s': round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+            }
+        sock.close()
+        return results
+    finally:
+        stop_server(proc, workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetHub download throughput benchmark")
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--port', type=int, default=55601)
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=4))
+
+
+if __name__ == "__main__":
+    main()
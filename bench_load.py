@@ -0,0 +1,353 @@
+"""Load generator: many simulated clients against a real server.py.
+
+Logs in --clients users (spread over --rooms with a uniform or Zipf room
+distribution), then for --seconds sends MSG at --msg-rate and GAME moves at
+--game-rate, while --transfer-clients upload and download --file-kb files.
+Reports connection setup rate (connect to ROOM_JOINED), end-to-end
+broadcast latency (send to every receiver, p50/p99/p999), throughput and
+server RSS. Clients are driven from several processes; every MSG carries
+its send time, read from a clock all processes on the host share.
+
+    python bench_load.py --engine threaded,asyncio --clients 1000 --output load.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import selectors
+import socket
+import threading
+import time
+from collections import Counter
+
+from bench_download import start_server, stop_server, login, wait_for, download_stream
+from file_transfer import iter_file_frames
+from network_utils import LineFramer, RECV_SIZE
+from passwords import hash_password
+
+PASSWORD = "bench"
+LOG_GROWTH = math.log(1.01) # Latency buckets ~1% wide
+
+
+def now_us():
+    # CLOCK_MONOTONIC on Linux: the same clock in every process on the host
+    return time.monotonic_ns() // 1000
+
+
+class Histogram:
+    """Log-bucketed latency histogram in microseconds, cheap to merge across processes."""
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    def add(self, us):
+        self.counts[int(math.log(max(us, 1)) / LOG_GROWTH)] += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def percentile(self, p):
+        total = sum(self.counts.values())
+        if not total:
+            return None
+        rank = p * total
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return math.exp((bucket + 0.5) * LOG_GROWTH)
+
+    def summary_ms(self):
+        summary = {'count': sum(self.counts.values())}
+        for name, p in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999)):
+            value = self.percentile(p)
+            summary[name] = round(value / 1000, 3) if value is not None else None
+        return summary
+
+
+def room_of(i, args):
+    # Deterministic so every run spreads users the same way
+    if args.room_dist == 'zipf':
+        weights = [1 / (r + 1) ** args.zipf_s for r in range(args.rooms)]
+        return f"room{random.Random(i).choices(range(args.rooms), weights)[0]}"
+    return f"room{i % args.rooms}"
+
+
+def rss_mb(pid):
+    # Resident memory of the server and its worker processes (Linux only)
+    total = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            if p == pid:
+                return None
+    return round(total / 1024, 1)
+
+
+def chat_process(port, ids, args, go, ready, load, results):
+    go.wait()
+
+    # Connection setup: LOGIN and JOIN_ROOM pipelined, done at ROOM_JOINED
+    sel = selectors.DefaultSelector()
+    conns = {}
+    setup = Histogram()
+    setup_start = now_us()
+    for i in ids:
+        started = now_us()
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(f"LOGIN|user{i}|{PASSWORD}\nJOIN_ROOM|{room_of(i, args)}\n".encode('utf-8'))
+        conns[sock] = {'framer': LineFramer(), 'started': started, 'joined': False}
+        sel.register(sock, selectors.EVENT_READ)
+    waiting = len(conns)
+    while waiting:
+        for key, _ in sel.select(30):
+            state = conns[key.fileobj]
+            data = key.fileobj.recv(RECV_SIZE)
+            if not data:
+                raise RuntimeError("Server closed a connection during setup")
+            state['framer'].feed(data)
+            for line, _ in state['framer'].messages():
+                if line.startswith("ROOM_JOINED") and not state['joined']:
+                    state['joined'] = True
+                    setup.add(now_us() - state['started'])
+                    waiting -= 1
+    ready.put((setup_start, now_us(), setup.counts))
+    load.wait()
+
+    # Steady load: MSG and GAME at fixed rates, round robin over our clients
+    socks = list(conns)
+    rng = random.Random(ids[0] if ids else 0)
+    latency = Histogram()
+    counts = Counter()
+    msg_interval = args.procs / args.msg_rate if args.msg_rate else None
+    game_interval = args.procs / args.game_rate if args.game_rate else None
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    next_msg = next_game = start
+    turn = 0
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        while msg_interval and next_msg <= now:
+            socks[turn % len(socks)].sendall(f"MSG|t:{now_us()}\n".encode('utf-8'))
+            turn += 1
+            counts['msgs_sent'] += 1
+            next_msg += msg_interval
+        while game_interval and next_game <= now:
+            rng.choice(socks).sendall(f"GAME|MOVE|{rng.randrange(9)}\n".encode('utf-8'))
+            counts['game_moves_sent'] += 1
+            next_game += game_interval
+        wake = min(t for t in (next_msg if msg_interval else None,
+                               next_game if game_interval else None, deadline) if t is not None)
+        for key, _ in sel.select(max(0, wake - time.perf_counter())):
+            data = key.fileobj.recv(RECV_SIZE)
+            if not data:
+                sel.unregister(key.fileobj)
+                counts['disconnects'] += 1
+                continue
+            framer = conns[key.fileobj]['framer']
+            framer.feed(data)
+            received = now_us()
+            for line, _ in framer.messages():
+                if line.startswith("MSG|"):
+                    content = line.split('|', 2)[2]
+                    if content.startswith("t:"):
+                        latency.add(received - int(content[2:]))
+                        counts['msgs_delivered'] += 1
+                elif line.startswith("GAME|"):
+                    counts['game_events'] += 1
+    results.put(('chat', latency.counts, dict(counts)))
+    for sock in socks:
+        sock.close()
+
+
+def transfer_thread(port, index, args, workdir, deadline, out):
+    sock, reader = login(port, f"xfer{index}", "transfer-room")
+    src = os.path.join(workdir, f"xfer{index}.bin")
+    with open(src, 'wb') as f:
+        f.write(os.urandom(args.file_kb * 1024))
+    upload, download = Histogram(), Histogram()
+    while time.perf_counter() < deadline:
+        name = f"x{index}-{time.perf_counter_ns()}.bin"
+        started = now_us()
+        for frame in iter_file_frames(src, name, 'UPLOAD'):
+            sock.sendall(frame)
+        wait_for(reader, f"UPLOAD_OK|{name}")
+        upload.add(now_us() - started)
+        started = now_us()
+        download_stream(sock, reader, name)
+        download.add(now_us() - started)
+    out.append((upload, download))
+    sock.close()
+
+
+def transfer_process(port, args, workdir, go, ready, load, results):
+    go.wait()
+    ready.put(None)
+    load.wait()
+    deadline = time.perf_counter() + args.seconds
+    out = []
+    threads = [threading.Thread(target=transfer_thread, args=(port, i, args, workdir, deadline, out))
+               for i in range(args.transfer_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    upload, download = Histogram(), Histogram()
+    for up, down in out:
+        upload.merge(up)
+        download.merge(down)
+    results.put(('transfer', upload.counts, download.counts))
+
+
+def run_one(args, engine, users_json):
+    extra = ['--workers', str(args.workers)] if args.workers > 1 else []
+    proc, workdir = start_server(engine, args.port, extra, files={'users.json': users_json})
+    try:
+        if args.workers > 1:
+            time.sleep(0.5) # Let every worker bind the port before clients connect
+        ctx = multiprocessing.get_context('spawn')
+        go, load = ctx.Event(), ctx.Event()
+        ready, results = ctx.Queue(), ctx.Queue()
+        procs = []
+        for p in range(args.procs):
+            ids = list(range(p, args.clients, args.procs))
+            procs.append(ctx.Process(target=chat_process, args=(args.port, ids, args, go, ready, load, results)))
+        if args.transfer_clients:
+            procs.append(ctx.Process(target=transfer_process,
+                                     args=(args.port, args, workdir, go, ready, load, results)))
+        for p in procs:
+            p.start()
+
+        rss_idle = rss_mb(proc.pid)
+        go.set()
+        setup = Histogram()
+        first = last = None
+        for _ in procs:
+            report = ready.get()
+            if report is None:
+                continue
+            started, finished, counts = report
+            setup.merge(Histogram(counts))
+            first = started if first is None else min(first, started)
+            last = finished if last is None else max(last, finished)
+        setup_seconds = (last - first) / 1e6 if first is not None else 0
+        rss_connected = rss_mb(proc.pid)
+
+        load.set()
+        start = time.perf_counter()
+        rss_peak = rss_connected
+        reports = []
+        while len(reports) < len(procs):
+            try:
+                reports.append(results.get(timeout=0.5))
+            except queue.Empty:
+                pass # Sample memory while waiting
+            rss = rss_mb(proc.pid)
+            if rss is not None and (rss_peak is None or rss > rss_peak):
+                rss_peak = rss
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+
+        latency, counts = Histogram(), Counter()
+        transfers = None
+        for report in reports:
+            if report[0] == 'chat':
+                latency.merge(Histogram(report[1]))
+                counts.update(report[2])
+            else:
+                upload, download = Histogram(report[1]), Histogram(report[2])
+                transfers = {
+                    'file_kb': args.file_kb,
+                    'upload_ms': upload.summary_ms(),
+                    'download_ms': download.summary_ms(),
+                    'round_trips_per_s': round(upload.summary_ms()['count'] / elapsed, 2),
+                    'mb_per_s': round(2 * upload.summary_ms()['count'] * args.file_kb / 1024 / elapsed, 2),
+                }
+        return {
+            'engine': engine,
+            'workers': args.workers,
+            'connections_per_s': round(args.clients / setup_seconds, 1) if setup_seconds else None,
+            'setup_ms': setup.summary_ms(),
+            'seconds': round(elapsed, 2),
+            'msgs_per_s': round(counts['msgs_sent'] / elapsed, 1),
+            'deliveries_per_s': round(counts['msgs_delivered'] / elapsed, 1),
+            'broadcast_latency_ms': latency.summary_ms(),
+            'game_moves_per_s': round(counts['game_moves_sent'] / elapsed, 1),
+            'game_events_per_s': round(counts['game_events'] / elapsed, 1),
+            'disconnects': counts['disconnects'],
+            'transfers': transfers,
+            'server_rss_mb': {'idle': rss_idle, 'connected': rss_connected, 'peak': rss_peak},
+        }
+    finally:
+        stop_server(proc, workdir)
+
+
+def raise_fd_limit():
+    # Thousands of sockets on both ends; the server inherits the limit from us
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetHub load generator")
+    parser.add_argument('--engine', default='threaded,asyncio', help="comma separated engines to run in turn")
+    parser.add_argument('--port', type=int, default=55604)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--room-dist', choices=('uniform', 'zipf'), default='uniform')
+    parser.add_argument('--zipf-s', type=float, default=1.0, help="Zipf exponent for --room-dist zipf")
+    parser.add_argument('--msg-rate', type=float, default=500, help="MSG per second, all clients together")
+    parser.add_argument('--game-rate', type=float, default=5, help="GAME moves per second")
+    parser.add_argument('--transfer-clients', type=int, default=1)
+    parser.add_argument('--file-kb', type=int, default=1024)
+    parser.add_argument('--procs', type=int, default=min(4, os.cpu_count() or 1),
+                        help="load generator processes")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    args = parser.parse_args()
+    args.procs = max(1, min(args.procs, args.clients))
+
+    raise_fd_limit()
+    # One real hash shared by every user: logins cost what they cost in production
+    record = {"password": hash_password(PASSWORD), "role": "user"}
+    users_json = json.dumps({f"user{i}": record for i in range(args.clients)})
+
+    report = {
+        'clients': args.clients,
+        'rooms': args.rooms,
+        'room_dist': args.room_dist,
+        'msg_rate': args.msg_rate,
+        'game_rate': args.game_rate,
+        'transfer_clients': args.transfer_clients,
+        'cpus': os.cpu_count(),
+        'runs': [run_one(args, engine, users_json) for engine in args.engine.split(',')],
+    }
+    text = json.dumps(report, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Login capacity benchmark.
+
+Registers a set of users, then hammers LOGIN from concurrent connections for
+a fixed time and reports logins/sec. A probe client chats with itself the
+whole time to show that hashing does not stall other traffic.
+
+    python bench_login.py --engine asyncio --clients 16 --seconds 10
+"""
+import argparse
+import json
+import socket
+import statistics
+import threading
+import time
+
+from bench_download import start_server, stop_server, server_cpu_seconds, login, wait_for
+from network_utils import SocketBuffer
+
+
+def login_worker(port, username, deadline, counts, index):
+    sock = socket.create_connection(('127.0.0.1', port))
+    reader = SocketBuffer(sock)
+    sock.sendall(f"REGISTER|{username}|bench\n".encode('utf-8'))
+    reader.read_line()
+    done = 0
+    while time.perf_counter() < deadline:
+        sock.sendall(f"LOGIN|{username}|bench\n".encode('utf-8'))
+        if reader.read_line().startswith("LOGIN_SUCCESS"):
+            done += 1
+    counts[index] = done
+    sock.close()
+
+
+def probe_worker(port, stop, latencies):
+    sock, reader = login(port, "probe", "probe-room")
+    while not stop.is_set():
+        start = time.perf_counter()
+        sock.sendall(b"MSG|ping\n")
+        wait_for(reader, "MSG|probe|")
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+    sock.close()
+
+
+def run(args):
+    proc, workdir = start_server(args.engine, args.port)
+    try:
+        stop = threading.Event()
+        latencies = []
+        probe = threading.Thread(target=probe_worker, args=(args.port, stop, latencies))
+        probe.start()
+
+        counts = [0] * args.clients
+        cpu_before = server_cpu_seconds(proc.pid)
+        start = time.perf_counter()
+        deadline = start + args.seconds
+        workers = [threading.Thread(target=login_worker, args=(args.port, f"user{i}", deadline, counts, i))
+                   for i in range(args.clients)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        cpu_after = server_cpu_seconds(proc.pid)
+        stop.set()
+        probe.join()
+
+        latencies.sort()
+        return {
+            'engine': args.engine,
+            'clients': args.clients,
+            'seconds': round(elapsed, 2),
+            'logins': sum(counts),
+            'logins_per_s': round(sum(counts) / elapsed, 1),
+            'server_cpu_s': round(cpu_after - cpu_before, 2) if cpu_before is not None else None,
+            'probe_msg_rtt_ms': {
+                'p50': round(statistics.median(latencies), 2) if latencies else None,
+                'p99': round(latencies[int(len(latencies) * 0.99)], 2) if latencies else None,
+            },
+        }
+    finally:
+        stop_server(proc, workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetHub login capacity benchmark")
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--port', type=int, default=55602)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=4))
+
+
+if __name__ == "__main__":
+    main()
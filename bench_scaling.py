@@ -0,0 +1,137 @@
+"""Chat throughput vs. worker processes (server.py --workers N).
+
+For each worker count, starts a server, logs in clients spread over a few
+rooms and lets every client keep a window of its own messages in flight for
+a fixed time. Reports messages/sec (echoes seen by their senders) and
+deliveries/sec (every MSG received by anyone). Clients are driven from
+several processes so the load generator is not the bottleneck.
+
+    python bench_scaling.py --workers 1,2,4 --clients 32 --rooms 4 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import time
+
+from bench_download import start_server, stop_server, server_cpu_seconds, login
+from network_utils import LineFramer, RECV_SIZE
+
+
+def tree_cpu_seconds(pid):
+    # The server and its worker processes (Linux only)
+    total = server_cpu_seconds(pid)
+    if total is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+    except OSError:
+        return total
+    return total + sum(server_cpu_seconds(int(child)) or 0 for child in children)
+
+
+def load_process(port, ids, rooms, window, seconds, ready, go, results):
+    conns = {}
+    for i in ids:
+        sock, _ = login(port, f"user{i}", f"room{i % rooms}")
+        conns[sock] = {'framer': LineFramer(), 'prefix': f"MSG|user{i}|"}
+    ready.put(len(conns))
+    go.wait()
+
+    sel = selectors.DefaultSelector()
+    for sock in conns:
+        sel.register(sock, selectors.EVENT_READ)
+        sock.sendall(b"MSG|bench\n" * window)
+
+    sent = delivered = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for key, _ in sel.select(0.1):
+            sock = key.fileobj
+            state = conns[sock]
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                sel.unregister(sock)
+                continue
+            state['framer'].feed(data)
+            echoes = 0
+            for line, _ in state['framer'].messages():
+                if line.startswith("MSG|"):
+                    delivered += 1
+                    if line.startswith(state['prefix']):
+                        echoes += 1
+            if echoes:
+                # Our own message came back: send as many new ones
+                sent += echoes
+                sock.sendall(b"MSG|bench\n" * echoes)
+    results.put((sent, delivered))
+    for sock in conns:
+        sock.close()
+
+
+def run_one(args, workers):
+    proc, workdir = start_server(args.engine, args.port, ['--workers', str(workers)])
+    try:
+        time.sleep(0.5) # Let every worker bind the port before clients connect
+        ctx = multiprocessing.get_context('spawn')
+        ready, results, go = ctx.Queue(), ctx.Queue(), ctx.Event()
+        procs = []
+        for p in range(args.procs):
+            ids = list(range(p, args.clients, args.procs))
+            procs.append(ctx.Process(target=load_process,
+                                     args=(args.port, ids, args.rooms, args.window,
+                                           args.seconds, ready, go, results)))
+        for p in procs:
+            p.start()
+        for _ in procs:
+            ready.get()
+
+        cpu_before = tree_cpu_seconds(proc.pid)
+        start = time.perf_counter()
+        go.set()
+        totals = [results.get() for _ in procs]
+        elapsed = time.perf_counter() - start
+        cpu_after = tree_cpu_seconds(proc.pid)
+        for p in procs:
+            p.join()
+
+        sent = sum(t[0] for t in totals)
+        delivered = sum(t[1] for t in totals)
+        return {
+            'workers': workers,
+            'seconds': round(elapsed, 2),
+            'msgs_per_s': round(sent / elapsed, 1),
+            'deliveries_per_s': round(delivered / elapsed, 1),
+            'server_cpu_s': round(cpu_after - cpu_before, 2) if cpu_before is not None else None,
+        }
+    finally:
+        stop_server(proc, workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetHub multi-process scaling benchmark")
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='asyncio')
+    parser.add_argument('--port', type=int, default=55603)
+    parser.add_argument('--workers', default='1,2,4', help="comma separated worker counts")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--window', type=int, default=4, help="messages in flight per client")
+    parser.add_argument('--procs', type=int, default=min(4, os.cpu_count() or 1),
+                        help="load generator processes")
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    report = {
+        'engine': args.engine,
+        'clients': args.clients,
+        'rooms': args.rooms,
+        'cpus': os.cpu_count(),
+        'runs': [run_one(args, int(n)) for n in args.workers.split(',')],
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from file_transfer import IncomingFile, CHUNK_SIZE
+
+# Shared files are stored once per content, as <dir>/<first 2 hex digits>/<sha256>.
+# Which room calls which blob what is kept by FileRegistry, which also counts
+# references and removes a blob once nothing points at it any more.
+#
+# Uploads that name their hash are resumable: they are written to
+# <dir>/partial/<sha256>.part, which stays when the connection drops, and a
+# later UPLOAD_START for the same hash continues at the offset the server has.
+# That may come before the server notices the old connection is gone (a
+# half-open TCP connection), so the new upload takes the partial file over
+# and the old one fails at its next write.
+HASH_LENGTH = 64
+PARTIAL_MAX_AGE = 7 * 24 * 3600 # seconds an abandoned partial upload survives a restart
+
+log = logging.getLogger(__name__)
+
+
+def is_blob_id(value):
+    return len(value) == HASH_LENGTH and all(c in '0123456789abcdef' for c in value)
+
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    """(sha256 hex, size) of a file, read one chunk at a time."""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+
+class IncomingBlob(IncomingFile):
+    """An upload hashed as it streams in; finish() moves it to its blob path.
+
+    With `expected` (the content's sha256) it is resumable from `offset`.
+    """
+    def __init__(self, store, size, expected=None, offset=0):
+        self.store = store
+        self.expected = expected
+        self.sha = hashlib.sha256()
+        if expected is None:
+            # The final path is only known at the end; the temp file goes in the store's root
+            super().__init__(os.path.join(store.directory, 'incoming'), size)
+            return
+        self.final_path = None
+        self.size = size
+        self.tmp_path = store.partial_path(expected)
+        store.claim(expected, self)
+        try:
+            # Unbuffered: nothing written before a takeover can land in the file after it
+            self.f = open(self.tmp_path, 'r+b' if os.path.exists(self.tmp_path) else 'w+b', buffering=0)
+            self._resume(offset)
+        except Exception:
+            self.suspend()
+            raise
+
+    def _resume(self, offset):
+        # Hash what is already there, then drop anything past offset.
+        # Reads the whole partial file: keep it off the event loop (see server.py)
+        if offset < 0 or offset > self.size:
+            raise ValueError(f"Bad resume offset: {offset}")
+        remaining = offset
+        while remaining:
+            chunk = self.f.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise ValueError(f"Only {offset - remaining} bytes to resume from, not {offset}")
+            self.sha.update(chunk)
+            remaining -= len(chunk)
+        self.f.truncate(offset)
+        self.f.seek(offset)
+        self.received = offset
+
+    def write(self, data):
+        self._check_claim()
+        super().write(data)
+        self.sha.update(data)
+
+    def _check_claim(self):
+        if self.expected is not None and not self.store.holds(self.expected, self):
+            raise ValueError("The upload was resumed from another connection")
+
+    def finish(self):
+        """Returns the sha256 of the content."""
+        self._check_claim()
+        sha256 = self.sha.hexdigest()
+        if self.expected and self.received == self.size and self.expected != sha256:
+            self.abort()
+            raise ValueError("Content does not match its hash")
+        self.final_path = self.store.path(sha256)
+        os.makedirs(os.path.dirname(self.final_path), exist_ok=True)
+        try:
+            super().finish()
+        finally:
+            self._release()
+        return sha256
+
+    def abort(self):
+        super().abort()
+        self._release()
+
+    def suspend(self):
+        """Connection lost: keep a resumable upload's data for later, drop any other."""
+        if self.expected is None:
+            return self.abort()
+        try:
+            self.f.close()
+        except (OSError, AttributeError):
+            pass
+        self._release()
+
+    def _release(self):
+        if self.expected is not None:
+            self.store.release(self.expected, self)
+
+
+class BlobStore:
+    """Immutable files named by their SHA-256."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.partial_dir = os.path.join(directory, 'partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.receiving = {} # sha256 -> IncomingBlob writing its partial file
+
+    def path(self, sha256):
+        if not is_blob_id(sha256):
+            raise ValueError(f"Not a blob id: {sha256!r}")
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def has(self, sha256, size=None):
+        try:
+            return size is None or os.path.getsize(self.path(sha256)) == size
+        except (OSError, ValueError):
+            return False
+
+    def incoming(self, size, expected=None, offset=0):
+        return IncomingBlob(self, size, expected, offset)
+
+    def partial_path(self, sha256):
+        if not is_blob_id(sha256):
+            raise ValueError(f"Not a blob id: {sha256!r}")
+        return os.path.join(self.partial_dir, sha256 + '.part')
+
+    def partial_size(self, sha256):
+        """Bytes of an interrupted (or stalled) upload of this content, 0 if none."""
+        try:
+            return os.path.getsize(self.partial_path(sha256))
+        except (OSError, ValueError):
+            return 0
+
+    def claim(self, sha256, owner):
+        # One upload at a time may write a given partial file (per process); the latest wins
+        with self.lock:
+            if sha256 in self.receiving:
+                log.info("Upload of %s resumed by another connection, taking it over", sha256)
+            self.receiving[sha256] = owner
+
+    def holds(self, sha256, owner):
+        with self.lock:
+            return self.receiving.get(sha256) is owner
+
+    def release(self, sha256, owner):
+        with self.lock:
+            if self.receiving.get(sha256) is owner:
+                del self.receiving[sha256]
+
+    def adopt(self, path):
+        """Move an existing file into the store; returns (sha256, size)."""
+        sha256, size = file_digest(path)
+        final_path = self.path(sha256)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(path, final_path)
+        return sha256, size
+
+    def remove(self, sha256):
+        try:
+            os.remove(self.path(sha256))
+        except (OSError, ValueError):
+            pass
+
+    def sweep(self, live):
+        """Delete blobs not in `live`, temp files of interrupted uploads and
+        resumable ones older than PARTIAL_MAX_AGE.
+
+        Only safe while nothing is uploading (at startup). An empty `live` while
+        blobs exist is taken for a lost registry, and no blob is removed then.
+        Returns the number removed.
+        """
+        expired = time.time() - PARTIAL_MAX_AGE
+        stale, blobs = [], 0
+        for dirpath, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if dirpath == self.partial_dir:
+                    if os.path.getmtime(path) <= expired:
+                        stale.append(path)
+                elif dirpath == self.directory:
+                    stale.append(path) # Temp file of an interrupted upload
+                else:
+                    blobs += 1
+                    if name not in live:
+                        stale.append(path)
+        if not live and blobs:
+            log.warning("No file refers to any of the %s blob(s) in %s; keeping them", blobs, self.directory)
+            stale = [path for path in stale if os.path.dirname(path) in (self.directory, self.partial_dir)]
+        removed = 0
+        for path in stale:
+            try:
+                os.remove(path)
+                removed += 1
+                log.info("Removed unreferenced %s", path)
+            except OSError:
+                pass
+        return removed
@@ -1,15 +1,22 @@
 import socket
 import threading
+import queue
 import tkinter as tk
 from tkinter import simpledialog, messagebox,  ttk, filedialog
-import base64
 import os
+import bisect
+import time
 import speedtest
+from collections import deque
 from datetime import datetime
 
 # Custom modules
-from config import HOST, PORT, COLORS
+from config import HOST, PORT, RECONNECT_DELAYS, COLORS, UI_TICK, UI_BATCH_SIZE, CHAT_BATCH_SIZE, CHAT_SCROLLBACK
 from network_utils import SocketBuffer
+from file_transfer import IncomingFile, iter_file_frames
+from blob_store import file_digest
+from compression import Deflater, is_compressed_type, COMPRESS_MIN
+from protocol import deflate_frame
 from game_window import TicTacToeWindow
 from ui_components import NetHubUI
 
@@ -37,7 +44,21 @@ class NetHubApp:
         self.current_room = None
         self.running = True
         self.sock_buffer = SocketBuffer(self.client)
+        self.send_lock = threading.Lock() # Keeps upload frames and chat lines from interleaving
+        self.deflater = None # Set when the server agrees to compression at login
+        self.pending_downloads = {} # filename -> chosen save path
+        self.pending_uploads = {} # filename -> (path, sha256, size) until UPLOAD_OK/UPLOAD_FAIL
+        self.incoming_file = None
+        self.incoming = None # (filename, version) of the download in incoming_file
+        self.credentials = None # to log in again after a reconnect
+        self.reconnecting = False
+        self.members = [] # sorted (username, ip or None), mirrors ui.user_list
+        self.members_version = None
+        self.history_oldest = None # id of the oldest history entry shown, while older ones exist
+        self.history_paging = False # a HISTORY_BEFORE page is on its way
         self.game_window = None 
+        self.ui_events = queue.SimpleQueue() # (fn, args) for the Tk loop, put by any thread
+        self.chat_queue = deque() # (kind, args) waiting for flush_chat, Tk loop only
 
         # UI Frames
         self.login_frame = ttk.Frame(self.root)
@@ -52,7 +73,9 @@ class NetHubApp:
                                   on_game=self.open_game, 
                                   on_upload=self.upload_file, 
                                   on_send=self.send_message,
-                                  on_emoji=self.open_emoji_picker)
+                                  on_emoji=self.open_emoji_picker,
+                                  on_file=self.request_download)
+        self.ui.chat_area.tag_bind("load_older", "<Button-1>", lambda e: self.load_older())
 
         # Start with Login
         self.show_frame(self.login_frame)
@@ -60,6 +83,7 @@ class NetHubApp:
         # Network Thread
         self.thread = threading.Thread(target=self.receive)
         self.thread.start()
+        self.root.after(int(UI_TICK * 1000), self.poll_ui)
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.root.mainloop()
@@ -91,18 +115,33 @@ class NetHubApp:
         
         for i in range(cols): picker.columnconfigure(i, weight=1)
         for i in range(len(emojis)//cols + 1): picker.rowconfigure(i, weight=1)
+    def _send_bytes(self, data, compressible=True):
+        # Caller must hold send_lock (the deflate stream must stay in order)
+        if self.deflater and compressible and len(data) >= COMPRESS_MIN:
+            data = b"".join(deflate_frame(piece) for piece in self.deflater.compress(data))
+        self.client.sendall(data)
+
     def send_packet(self, text):
         try:
-            self.client.send((text + "\n").encode('utf-8'))
-        except:
-             messagebox.showerror("Error", "Connection lost.")
-             self.on_close()
+            with self.send_lock:
+                self._send_bytes((text + "\n").encode('utf-8'))
+        except OSError:
+            # The receive thread notices as well and reconnects
+            self._drop_connection(self.client)
+
+    def _drop_connection(self, sock):
+        # Wakes up a recv() blocked on sock
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def do_login(self):
         u = self.ui.entry_user.get()
         p = self.ui.entry_pass.get()
         if u and p:
-            self.send_packet(f"LOGIN|{u}|{p}")
+            self.credentials = (u, p)
+            self.send_packet(f"LOGIN|{u}|{p}|deflate")
 
     def do_register(self):
         u = self.ui.entry_user.get()
@@ -126,36 +165,104 @@ class NetHubApp:
         filepath = filedialog.askopenfilename()
         if filepath:
             filename = os.path.basename(filepath)
-            threading.Thread(target=self._upload_thread, args=(filepath, filename)).start()
+            threading.Thread(target=self._probe_thread, args=(filepath, filename)).start()
 
-    def _upload_thread(self, filepath, filename):
+    def _probe_thread(self, filepath, filename):
+        # Hash first; the file is only sent if the server answers UPLOAD_NEED
         try:
-            with open(filepath, "rb") as f:
-                file_data = base64.b64encode(f.read()).decode('utf-8')
-                self.root.after(0, lambda: self.send_packet(f"UPLOAD|{filename}|{file_data}"))
-            self.root.after(0, lambda: messagebox.showinfo("Upload", "File uploaded successfully!"))
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Upload failed: {e}"))
+            sha256, size = file_digest(filepath)
+        except OSError as e:
+            self.post(messagebox.showerror, "Error", f"Upload failed: {e}")
+            return
+        self.pending_uploads[filename] = (filepath, sha256, size)
+        self.send_packet(f"UPLOAD_PROBE|{filename}|{size}|{sha256}")
+
+    def _upload_thread(self, filepath, filename, sha256, offset):
+        # Streams the file in chunks from offset; the server confirms with UPLOAD_OK
+        compressible = not is_compressed_type(filename)
+        sock = self.client
+        try:
+            for frame in iter_file_frames(filepath, filename, 'UPLOAD', sha256=sha256, offset=offset):
+                with self.send_lock:
+                    if self.client is not sock:
+                        return # Reconnected: the upload is resumed from a new probe
+                    try:
+                        self._send_bytes(frame, compressible)
+                    except OSError:
+                        self._drop_connection(sock)
+                        return
+        except OSError as e:
+            # Reading the file failed
+            self.pending_uploads.pop(filename, None)
+            self.post(messagebox.showerror, "Error", f"Upload failed: {e}")
 
     def request_download(self, filename):
-        self.send_packet(f"DOWNLOAD|{filename}")
-
-    def save_file(self, filename, b64_data):
+        # Ask where to save first, so chunks can go straight to disk as they arrive
         save_path = filedialog.asksaveasfilename(initialfile=filename)
         if save_path:
-            threading.Thread(target=self._save_thread, args=(save_path, b64_data)).start()
-    
-    def _save_thread(self, save_path, b64_data):
+            self.pending_downloads[filename] = save_path
+            self.send_packet(f"DOWNLOAD_STREAM|{filename}")
+
+    def _begin_download(self, filename, size, offset, version):
+        if self.incoming and self.incoming[0] == filename:
+            # Resumed after a reconnect; offset 0 means the file changed, so start over
+            if offset and offset == self.incoming_file.received:
+                self.incoming = (filename, version)
+                return
+            self.pending_downloads[filename] = self.incoming_file.final_path
+            self.incoming_file.abort()
+        save_path = self.pending_downloads.pop(filename, None)
+        if save_path:
+            self.incoming_file = IncomingFile(save_path, size)
+            self.incoming = (filename, version)
+
+    def _finish_download(self):
         try:
-            with open(save_path, "wb") as f:
-                f.write(base64.b64decode(b64_data))
-            self.root.after(0, lambda: messagebox.showinfo("Download", "File saved successfully!"))
+            self.incoming_file.finish()
+            self.post(messagebox.showinfo, "Download", "File saved successfully!")
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Save failed: {e}"))
-    
+            self.post(messagebox.showerror, "Error", f"Save failed: {e}")
+        self.incoming_file = None
+        self.incoming = None
+
+    # --- Reconnect ---
+    def _reconnect(self):
+        # Connection lost: connect again, log in, rejoin the room, resume transfers
+        self.queue_chat('local', "Connection lost, reconnecting...")
+        for delay in RECONNECT_DELAYS:
+            time.sleep(delay)
+            if not self.running:
+                return False
+            try:
+                sock = socket.create_connection((HOST, PORT), timeout=10)
+            except OSError:
+                continue
+            sock.settimeout(None)
+            with self.send_lock:
+                old, self.client = self.client, sock
+                self.sock_buffer = SocketBuffer(sock)
+                self.deflater = None
+            try:
+                old.close()
+            except OSError:
+                pass
+            if self.credentials:
+                self.reconnecting = True
+                self.send_packet(f"LOGIN|{self.credentials[0]}|{self.credentials[1]}|deflate")
+            return True
+        return False
+
+    def _resume_transfers(self):
+        # Uploads ask again where to go on from; the download asks for the rest
+        for filename, (_, sha256, size) in list(self.pending_uploads.items()):
+            self.send_packet(f"UPLOAD_PROBE|{filename}|{size}|{sha256}")
+        if self.incoming:
+            filename, version = self.incoming
+            self.send_packet(f"DOWNLOAD_STREAM|{filename}|{self.incoming_file.received}|{version}")
+
     # --- Speed Test ---
     def check_speed(self):
-        self.add_local_msg("running network speed test...", "system")
+        self.queue_chat('local', "running network speed test...")
         threading.Thread(target=self.run_speedtest).start()
 
     def run_speedtest(self):
@@ -165,9 +272,9 @@ class NetHubApp:
             dl = st.download() / 1_000_000
             ul = st.upload() / 1_000_000
             msg = f"Speed Test Finished:\nDownload: {dl:.2f} Mbps\nUpload: {ul:.2f} Mbps"
-            self.root.after(0, lambda: self.add_local_msg(msg, "system"))
+            self.queue_chat('local', msg)
         except Exception as e:
-            self.root.after(0, lambda: self.add_local_msg(f"Speed Test Failed: {e}", "system"))
+            self.queue_chat('local', f"Speed Test Failed: {e}")
 
     # --- Game Logic ---
     def open_game(self):
@@ -176,49 +283,189 @@ class NetHubApp:
         else:
             self.game_window.top.lift()
 
+    def forward_game(self, sender, content):
+        if self.game_window and tk.Toplevel.winfo_exists(self.game_window.top):
+            self.game_window.handle_packet(sender, content)
+
+    # --- UI Dispatch ---
+    # Tk is not thread-safe: other threads never touch widgets (or call
+    # root.after), they post() events. The Tk loop handles up to UI_BATCH_SIZE
+    # of them per UI_TICK and then draws the chat lines they queued in one batch,
+    # so a busy room can neither flood the event loop nor hold up recv().
+    def post(self, fn, *args):
+        # Any thread: run fn(*args) on the Tk loop
+        self.ui_events.put((fn, args))
+
+    def queue_chat(self, kind, *args):
+        # Any thread. kind: 'msg', 'server', 'file', 'local', 'history' or 'clear'
+        self.post(self.chat_queue.append, (kind, args))
+
+    def poll_ui(self):
+        for _ in range(UI_BATCH_SIZE):
+            try:
+                fn, args = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                # e.g. its window was closed meanwhile; keep polling either way
+                print("UI error:", e)
+        if self.chat_queue:
+            self.flush_chat()
+        # Behind: come back as soon as Tk has handled input and redraws
+        backlog = not self.ui_events.empty() or self.chat_queue
+        self.root.after(1 if backlog else int(UI_TICK * 1000), self.poll_ui)
+
     # --- Display Logic ---
-    def add_chat(self, user, content, type="msg"):
-        self.ui.chat_area.config(state='normal')
-        
+    def flush_chat(self):
+        # Up to CHAT_BATCH_SIZE queued lines, with one state toggle and one scroll
+        chat = self.ui.chat_area
+        chat.config(state='normal')
+        scroll = older = False
+        for _ in range(min(len(self.chat_queue), CHAT_BATCH_SIZE)):
+            kind, args = self.chat_queue.popleft()
+            if kind == 'msg':
+                self.add_chat(*args)
+            elif kind == 'server':
+                self.add_chat("System", args[0], type="server")
+            elif kind == 'file':
+                self.add_file_link(*args)
+            elif kind == 'local':
+                self.add_local_msg(args[0], "system")
+            elif kind == 'history':
+                self.show_history(*args)
+            elif kind == 'clear':
+                self.clear_chat()
+            # Older history pages go on top, where the user scrolled to
+            if kind == 'history' and args[2]:
+                older = True
+            else:
+                scroll = True
+        # Bounded scrollback, except right after the user asked for older messages
+        if not older and self.ui.trim_chat(CHAT_SCROLLBACK):
+            # What "Load older" would continue from is gone
+            self.history_oldest = None
+        if scroll:
+            chat.yview('end')
+        chat.config(state='disabled')
+
+    # The add_*, clear and show_history methods below run inside flush_chat,
+    # with chat_area editable
+    def add_chat(self, user, content, type="msg", sent_at=None, at='end'):
+        # sent_at: epoch seconds for history entries; at: 'end' or the "history" mark
         if type == "server":
-            self.ui.chat_area.insert('end', f"\n---------------- {content} ----------------\n", "system")
+            self.ui.chat_area.insert(at, f"\n---------------- {content} ----------------\n", "system")
         else:
             is_me = (user == self.username)
             username_tag = "username_self" if is_me else "username_other"
-            timestamp = datetime.now().strftime("%H:%M")
+            when = datetime.fromtimestamp(sent_at) if sent_at else datetime.now()
+            timestamp = when.strftime("%H:%M")
             
-            self.ui.chat_area.insert('end', f"\n{user}", username_tag)
-            self.ui.chat_area.insert('end', f" [{timestamp}] says:\n", "timestamp") 
-            self.ui.chat_area.insert('end', f"{content}\n", "bubble")
-            
-        self.ui.chat_area.yview('end')
-        self.ui.chat_area.config(state='disabled')
+            self.ui.chat_area.insert(at, f"\n{user}", username_tag)
+            self.ui.chat_area.insert(at, f" [{timestamp}] says:\n", "timestamp") 
+            self.ui.chat_area.insert(at, f"{content}\n", "bubble")
 
     def add_local_msg(self, content, type="msg"):
-        self.ui.chat_area.config(state='normal')
         if type == "system":
              self.ui.chat_area.insert('end', f"\n--- {content} ---\n", "system")
-        self.ui.chat_area.yview('end')
-        self.ui.chat_area.config(state='disabled')
 
-    def add_file_link(self, user, filename):
-        self.ui.chat_area.config(state='normal')
-        
+    def add_file_link(self, user, filename, at='end'):
         is_me = (user == self.username)
         username_tag = "username_self" if is_me else "username_other"
 
-        self.ui.chat_area.insert('end', f"\n{user}", username_tag)
-        self.ui.chat_area.insert('end', " shared a file:\n")
-        
-        btn = tk.Button(self.ui.chat_area, text=f"📄 {filename}", command=lambda f=filename: self.request_download(f), 
-                        font=("Segoe UI", 10), bg=COLORS["bg_dark"], fg=COLORS["primary"], 
-                        activebackground=COLORS["input_bg"], activeforeground="white",
-                        bd=0, cursor="hand2")
-        self.ui.chat_area.window_create('end', window=btn)
-        self.ui.chat_area.insert('end', "\n")
-        
-        self.ui.chat_area.yview('end')
-        self.ui.chat_area.config(state='disabled')
+        self.ui.chat_area.insert(at, f"\n{user}", username_tag)
+        self.ui.chat_area.insert(at, " shared a file:\n")
+        self.ui.insert_file_link(at, filename)
+        self.ui.chat_area.insert(at, "\n")
+
+    # --- Room History ---
+    def clear_chat(self):
+        self.history_oldest = None
+        self.ui.chat_area.delete('1.0', 'end')
+
+    def show_history(self, entries, more, older):
+        # entries: "id|timestamp|MSG|user|text" or "id|timestamp|FILE_NOTIF|user|file", oldest first.
+        # The JOIN_ROOM backfill is appended; older pages go above everything shown.
+        chat = self.ui.chat_area
+        link = chat.tag_ranges("load_older")
+        if link:
+            chat.delete(link[0], link[1])
+        at = 'end'
+        if older:
+            # Inserts at a mark keep their order, so the page reads top to bottom
+            chat.mark_set("history", "1.0")
+            at = "history"
+        for entry in entries:
+            fields = entry.split('|', 4)
+            if len(fields) < 5:
+                continue
+            if fields[2] == "MSG":
+                self.add_chat(fields[3], fields[4], sent_at=int(fields[1]), at=at)
+            elif fields[2] == "FILE_NOTIF":
+                self.add_file_link(fields[3], fields[4], at=at)
+
+        self.history_oldest = int(entries[0].split('|', 1)[0]) if entries and more else None
+        if self.history_oldest:
+            chat.insert("1.0", "⬆ Load older messages\n", ("system", "load_older"))
+
+    def load_older(self):
+        if self.history_oldest:
+            self.history_paging = True
+            self.send_packet(f"HISTORY_BEFORE|{self.history_oldest}")
+            self.history_oldest = None # Until the page arrives
+
+    # --- Online Users ---
+    def _member_rows(self, member):
+        u, ip = member
+        if ip is None:
+            return [f"🟢 {u}"]
+        return [f"👁️ {u}", f"   └ {ip}"]
+
+    def _parse_member(self, entry):
+        # format: username or username#ip:port
+        if '#' in entry:
+            u, ip = entry.split('#', 1)
+            return (u, ip)
+        return (entry, None)
+
+    def _member_row_index(self, pos):
+        return sum(len(self._member_rows(m)) for m in self.members[:pos])
+
+    def set_user_list(self, entries, version):
+        self.members = sorted((self._parse_member(e) for e in entries), key=lambda m: m[0])
+        self.members_version = version
+        self.ui.user_list.delete(0, 'end')
+        for m in self.members:
+            for row in self._member_rows(m):
+                self.ui.user_list.insert('end', row)
+
+    def apply_presence(self, version, changes):
+        # Only touches the rows that changed instead of rebuilding the list
+        if self.members_version is None:
+            return # No snapshot yet; it will include this change
+        if version != self.members_version + 1:
+            if version > self.members_version:
+                # Missed a delta: ignore the rest until the fresh snapshot arrives
+                self.members_version = None
+                self.send_packet("USERLIST")
+            return
+        self.members_version = version
+
+        for action, entries in changes:
+            for entry in entries:
+                member = self._parse_member(entry)
+                if action == "JOIN":
+                    pos = bisect.bisect_right([m[0] for m in self.members], member[0])
+                    row = self._member_row_index(pos)
+                    self.members.insert(pos, member)
+                    for i, text in enumerate(self._member_rows(member)):
+                        self.ui.user_list.insert(row + i, text)
+                elif action == "LEAVE" and member in self.members:
+                    pos = self.members.index(member)
+                    row = self._member_row_index(pos)
+                    self.ui.user_list.delete(row, row + len(self._member_rows(member)) - 1)
+                    del self.members[pos]
 
     def on_close(self):
         self.running = False
@@ -230,93 +477,127 @@ class NetHubApp:
         exit()
 
     # --- Network Loop ---
+    def process_message(self, message, payload):
+        # Binary frames carry a raw payload right after the header line
+        if payload is not None:
+            if message.startswith("HISTORY|"):
+                # HISTORY|room|more|n: entries after JOIN_ROOM, or a page asked for with HISTORY_BEFORE
+                more = message.split('|')[2] == "1"
+                entries = payload.decode('utf-8', errors='replace').splitlines()
+                older, self.history_paging = self.history_paging, False
+                self.queue_chat('history', entries, more, older)
+            elif self.incoming_file:
+                self.incoming_file.write(payload)
+            return
+
+        parts = message.split('|')
+        cmd = parts[0]
+
+        if cmd == "REGISTER_SUCCESS":
+            self.post(messagebox.showinfo, "Success", "Registered! You can now login.")
+        elif cmd == "REGISTER_FAIL":
+            self.post(messagebox.showerror, "Error", parts[1])
+        elif cmd == "LOGIN_SUCCESS":
+            self.username = parts[1]
+            if len(parts) > 2 and parts[2] == "deflate" and self.deflater is None:
+                with self.send_lock:
+                    self.deflater = Deflater()
+            if self.reconnecting and self.current_room:
+                self.send_packet(f"JOIN_ROOM|{self.current_room}")
+            else:
+                self.reconnecting = False
+                self.post(self.show_frame, self.room_frame)
+        elif cmd == "LOGIN_FAIL":
+            self.reconnecting = False
+            self.post(messagebox.showerror, "Error", parts[1])
+        elif cmd == "ROOM_JOINED":
+            self.current_room = parts[1]
+            if self.reconnecting:
+                self.reconnecting = False
+                self._resume_transfers()
+            # The room's history follows, so start from a clean slate
+            self.queue_chat('clear')
+            self.post(self.ui.lbl_room_title.config, {'text': f"# {self.current_room}"})
+            self.post(self.show_frame, self.chat_frame)
+        elif cmd in ("USERLIST", "USERLIST_ADMIN"):
+            # Full snapshot: USERLIST|user1,user2,...|version
+            #                USERLIST_ADMIN|u1#ip1,u2#ip2,...|version
+            if len(parts) > 1:
+                raw_list = parts[1]
+                version = int(parts[2]) if len(parts) > 2 else None
+                entries = raw_list.split(',') if raw_list else []
+                self.post(self.set_user_list, entries, version)
+
+        elif cmd in ("PRESENCE", "PRESENCE_ADMIN"):
+            # Batched delta: PRESENCE|version|JOIN|u1,u2|LEAVE|u3
+            # (PRESENCE_ADMIN entries are user#ip)
+            version = int(parts[1])
+            changes = [(action, entries.split(',')) for action, entries in zip(parts[2::2], parts[3::2])]
+            self.post(self.apply_presence, version, changes)
+
+        elif cmd == "MSG":
+            sender = parts[1]
+            content = parts[2]
+            self.queue_chat('msg', sender, content)
+        elif cmd == "SERVER":
+            self.queue_chat('server', parts[1])
+        elif cmd == "FILE_NOTIF":
+            self.queue_chat('file', parts[1], parts[2])
+        elif cmd == "FILE_START":
+            # FILE_START|name|size|offset|version (older servers send name and size only)
+            offset = int(parts[3]) if len(parts) > 3 else 0
+            version = parts[4] if len(parts) > 4 else ""
+            self._begin_download(parts[1], int(parts[2]), offset, version)
+        elif cmd == "FILE_END":
+            if self.incoming_file:
+                self._finish_download()
+        elif cmd == "UPLOAD_NEED":
+            # UPLOAD_NEED|name|offset: the server has the first offset bytes already
+            pending = self.pending_uploads.get(parts[1])
+            if pending:
+                offset = int(parts[2]) if len(parts) > 2 else 0
+                threading.Thread(target=self._upload_thread,
+                                 args=(pending[0], parts[1], pending[1], offset)).start()
+        elif cmd == "UPLOAD_OK":
+            self.pending_uploads.pop(parts[1], None)
+            self.post(messagebox.showinfo, "Upload", "File uploaded successfully!")
+        elif cmd == "UPLOAD_FAIL":
+            self.pending_uploads.pop(parts[1], None)
+            self.post(messagebox.showerror, "Error", f"Upload failed: {parts[2]}")
+        elif cmd == "GAME":
+            sender = parts[1]
+            # Game over is announced in the chat too
+            # Structure: GAME|sender|MOVE|cell|symbol|outcome
+            if len(parts) >= 6 and parts[2] == "MOVE" and parts[5] == "WIN":
+                self.queue_chat('local', f"🏆 Game Over! {sender} ({parts[4]}) won the match!")
+            elif len(parts) >= 6 and parts[2] == "MOVE" and parts[5] == "DRAW":
+                self.queue_chat('local', "🤝 Game Over! It's a Draw!")
+
+            # Always forward to game window for board updates
+            self.post(self.forward_game, sender, "|".join(parts[2:]))
+
     def receive(self):
         while self.running:
             try:
-                message = self.sock_buffer.read_line()
-                if message is None:
+                # All messages completed by one recv()
+                batch = self.sock_buffer.read_batch()
+                if batch is None:
+                    if self.running and self._reconnect():
+                        continue
                     break
-                
-                parts = message.split('|')
-                cmd = parts[0]
-
-                if cmd == "REGISTER_SUCCESS":
-                    messagebox.showinfo("Success", "Registered! You can now login.")
-                elif cmd == "REGISTER_FAIL":
-                    messagebox.showerror("Error", parts[1])
-                elif cmd == "LOGIN_SUCCESS":
-                    self.username = parts[1]
-                    self.root.after(0, lambda: self.show_frame(self.room_frame))
-                elif cmd == "LOGIN_FAIL":
-                    messagebox.showerror("Error", parts[1])
-                elif cmd == "ROOM_JOINED":
-                    self.current_room = parts[1]
-                    self.root.after(0, lambda: self.ui.lbl_room_title.config(text=f"# {self.current_room}"))
-                    self.root.after(0, lambda: self.show_frame(self.chat_frame))
-                elif cmd == "USERLIST":
-                    # USERLIST|user1,user2,...
-                    if len(parts) > 1:
-                        raw_list = parts[1]
-                        self.ui.user_list.delete(0, 'end')
-                        if raw_list:
-                            users = raw_list.split(',')
-                            for u in users:
-                                self.ui.user_list.insert('end', f"🟢 {u}")
-
-                elif cmd == "USERLIST_ADMIN":
-                    # USERLIST_ADMIN|u1#ip1,u2#ip2,...
-                    if len(parts) > 1:
-                        raw_list = parts[1]
-                        self.ui.user_list.delete(0, 'end')
-                        if raw_list:
-                            entries = raw_list.split(',')
-                            for entry in entries:
-                                # format: username#ip:port
-                                if '#' in entry:
-                                    u, ip = entry.split('#')
-                                    self.ui.user_list.insert('end', f"👁️ {u}")
-                                    self.ui.user_list.insert('end', f"   └ {ip}")
-                                else:
-                                    self.ui.user_list.insert('end', f"🟢 {entry}")
-
-                elif cmd == "MSG":
-                    sender = parts[1]
-                    content = parts[2]
-                    self.root.after(0, lambda s=sender, c=content: self.add_chat(s, c))
-                elif cmd == "SERVER":
-                    content = parts[1]
-                    self.root.after(0, lambda c=content: self.add_chat("System", c, type="server"))
-                elif cmd == "FILE_NOTIF":
-                    sender = parts[1]
-                    fname = parts[2]
-                    self.root.after(0, lambda s=sender, f=fname: self.add_file_link(s, f))
-                elif cmd == "FILE_DATA":
-                    fname = parts[1]
-                    data = parts[2]
-                    self.root.after(0, lambda f=fname, d=data: self.save_file(f, d))
-                elif cmd == "GAME":
-                    sender = parts[1]
-                    # Check for WIN/DRAW packets first to display in chat
-                    # Structure: GAME|sender|WIN|X|WinnerName
-                    if len(parts) >= 5 and parts[2] == "WIN":
-                        winner_symbol = parts[3]
-                        winner_name = parts[4]
-                        self.root.after(0, lambda: self.add_local_msg(f"🏆 Game Over! {winner_name} ({winner_symbol}) won the match!", "system"))
-                    elif len(parts) >= 3 and parts[2] == "DRAW":
-                        self.root.after(0, lambda: self.add_local_msg(f"🤝 Game Over! It's a Draw!", "system"))
-
-                    # Always forward to game window for board updates
-                    content = "|".join(parts[2:])
-                    if self.game_window and tk.Toplevel.winfo_exists(self.game_window.top):
-                        self.root.after(0, lambda s=sender, c=content: self.game_window.handle_packet(s, c))
+                for message, payload in batch:
+                    self.process_message(message, payload)
 
             except Exception as e:
                 print("Error:", e)
                 break
         
         if self.running:
-            self.root.after(0, lambda: messagebox.showerror("Connection Lost", "Server closed connection."))
-            self.on_close()
+            self.post(self.connection_lost)
+
+    def connection_lost(self):
+        messagebox.showerror("Connection Lost", "Server closed connection.")
+        self.on_close()
 
 if __name__ == "__main__":
     NetHubApp()
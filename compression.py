@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+import zlib
+
+# Optional per-connection compression, asked for at LOGIN (LOGIN|user|pass|deflate,
+# answered with LOGIN_SUCCESS|user|deflate). Each direction keeps one raw deflate
+# stream for the whole connection, so later messages reuse earlier ones as
+# dictionary. Writes of COMPRESS_MIN bytes or more go out as DEFLATE frames
+# (DEFLATE|n + n bytes, or a DEFLATE message in binary mode) holding ordinary
+# protocol data; every frame ends on a sync flush and is inflated on arrival.
+# A big write is split over several consecutive DEFLATE frames, so a message
+# may continue from one into the next.
+COMPRESS_MIN = 256
+COMPRESS_LEVEL = 6
+PIECE_SIZE = 256 * 1024 # Input per DEFLATE frame, keeps frames under MAX_CHUNK_SIZE
+
+# Judged by name only: these don't shrink, so their chunks skip deflate
+COMPRESSED_EXTENSIONS = frozenset((
+    '.7z', '.apk', '.avi', '.bz2', '.docx', '.gif', '.gz', '.jar', '.jpeg', '.jpg',
+    '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.pdf', '.png', '.pptx', '.rar',
+    '.tgz', '.webm', '.webp', '.xlsx', '.xz', '.zip', '.zst',
+))
+
+
+def is_compressed_type(filename):
+    return os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+class CompressionStats:
+    """Process-wide byte and CPU counters, to judge whether deflate pays off."""
+    FIELDS = ('out_raw', 'out_wire', 'out_plain', 'in_wire', 'in_raw', 'deflate_cpu_s', 'inflate_cpu_s')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+STATS = CompressionStats()
+
+
+class Deflater:
+    """Sending side of one connection. Not thread-safe: one writer at a time."""
+    def __init__(self, level=COMPRESS_LEVEL):
+        self.obj = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """data as a list of compressed pieces, one per DEFLATE frame."""
+        started = time.thread_time()
+        pieces = []
+        for i in range(0, len(data), PIECE_SIZE):
+            piece = self.obj.compress(data[i:i + PIECE_SIZE])
+            pieces.append(piece + self.obj.flush(zlib.Z_SYNC_FLUSH))
+        STATS.add(out_raw=len(data), out_wire=sum(len(p) for p in pieces),
+                  deflate_cpu_s=time.thread_time() - started)
+        return pieces
+
+
+class Inflater:
+    """Receiving side of one connection, created on the first DEFLATE frame."""
+    def __init__(self, max_size):
+        self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.max_size = max_size
+
+    def decompress(self, data):
+        started = time.thread_time()
+        out = self.obj.decompress(data, self.max_size)
+        if self.obj.unconsumed_tail:
+            raise ValueError(f"DEFLATE frame inflates beyond {self.max_size} bytes")
+        STATS.add(in_wire=len(data), in_raw=len(out), inflate_cpu_s=time.thread_time() - started)
+        return out
@@ -1,6 +1,13 @@
 # Network Configuration
 HOST = '127.0.0.1'
 PORT = 55555
+RECONNECT_DELAYS = (1, 2, 5, 10, 30, 30, 30, 30) # seconds before each reconnect attempt
+
+# UI updates: the network thread queues events, the Tk loop handles them once per tick
+UI_TICK = 1 / 30 # seconds
+UI_BATCH_SIZE = 500 # events handled per tick; the rest wait for the next one
+CHAT_BATCH_SIZE = 200 # chat lines drawn per tick
+CHAT_SCROLLBACK = 5000 # lines kept in the chat; older ones are dropped
 
 # Theme Configuration
 COLORS = {
@@ -0,0 +1,346 @@
+import socket
+import threading
+import asyncio
+from collections import deque
+
+from file_transfer import FileRegion
+from protocol import Packet, encode_frame, deflate_frame, BATCH_SIZE
+from compression import Deflater, STATS as COMPRESSION_STATS, COMPRESS_MIN
+from metrics import METRICS
+
+# Outbound queue configuration
+OUTBOUND_QUEUE_SIZE = 1024 # Max queued broadcast messages per client
+
+# What to do when a client can't keep up with its broadcasts:
+#   'drop_oldest' - discard the oldest queued broadcast
+#   'disconnect'  - close the slow connection
+#   'coalesce'    - keep only the newest of superseded updates (queued presence
+#                   deltas of a room become one user list snapshot),
+#                   then fall back to dropping the oldest broadcast
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'disconnect', 'coalesce')
+SLOW_CONSUMER_POLICY = 'drop_oldest'
+
+METRICS.describe('nethub_bytes_sent_total', 'counter', "Bytes written to sockets, by traffic")
+METRICS.describe('nethub_file_bytes_total', 'counter', "File content sent or received, by direction")
+METRICS.describe('nethub_dropped_total', 'counter', "Broadcasts dropped for slow consumers, by policy")
+METRICS.describe('nethub_write_errors_total', 'counter', "Connections closed by a failed write")
+
+
+class OutboundQueue:
+    """Bounded per-client queue of pre-encoded frames, drained by a writer.
+
+    Items are (data, droppable, key, message); data is the shared bytes of a
+    Packet in this connection's wire format. For binary connections (see
+    protocol.py) `message` is set and the writer packs queued messages into
+    frames. Direct replies are never dropped; only broadcasts pushed with
+    push() are subject to the slow consumer policy. File transfers are queued
+    separately as streams of frames, so chat keeps flowing between their
+    chunks. Subclasses provide the writer and the _wakeup() hook.
+    """
+    def __init__(self, maxsize=None, policy=None):
+        self.maxsize = maxsize or OUTBOUND_QUEUE_SIZE
+        self.policy = policy or SLOW_CONSUMER_POLICY
+        self.items = deque()
+        self.streams = deque() # iterators of frames, sent one frame at a time
+        self.droppable = 0
+        self.dropped = 0
+        self.closed = False
+        self.binary = False
+        self.deflater = None
+        self.traffic = 'client' # Metrics label; the room bus uses this class too
+
+    def use_binary(self):
+        # Everything queued from now on is sent as binary frames
+        self.binary = True
+
+    def use_compression(self):
+        # Negotiated at LOGIN; the writer deflates from its next write on
+        self.deflater = Deflater()
+
+    def _deflate(self, data):
+        # Writer only: DEFLATE frames for big writes on compressing connections
+        if self.deflater is None:
+            return data
+        if len(data) < COMPRESS_MIN:
+            COMPRESSION_STATS.add(out_plain=len(data))
+            return data
+        return b"".join(deflate_frame(piece, self.binary) for piece in self.deflater.compress(data))
+
+    def _region_bytes(self, frame):
+        # A compressible file chunk on a compressing connection: read it instead of sendfile()
+        frame.file.seek(frame.offset)
+        return self._deflate(frame.header(self.binary) + frame.file.read(frame.count))
+
+    def send(self, packet):
+        # Direct reply to this client (never dropped)
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        data, message = self._encode(packet)
+        self._append(data, False, None, message)
+        return len(data)
+
+    def push(self, packet, key=None, snapshot=None):
+        # Broadcast frame; returns False if the client was disconnected for being slow.
+        # Coalescing replaces queued broadcasts of the same key: with `snapshot`
+        # (the state they and packet add up to) when there were any, else with packet.
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        if self.policy == 'coalesce' and key is not None and self._remove_key(key) and snapshot is not None:
+            packet = snapshot
+        data, message = self._encode(packet)
+        if self.droppable >= self.maxsize:
+            if self.policy == 'disconnect':
+                self.close()
+                return False
+            self._drop_oldest()
+        self._append(data, True, key, message)
+        return True
+
+    def send_stream(self, frames):
+        # Queue an iterator of frames (e.g. file_transfer.iter_file_frames)
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        self.streams.append(frames)
+        self._wakeup()
+
+    def _sent(self, n, region=None):
+        # Writer only: count what went out, file content separately too
+        METRICS.inc('nethub_bytes_sent_total', n, traffic=self.traffic)
+        if region is not None:
+            METRICS.inc('nethub_file_bytes_total', region.count, direction='out')
+
+    def _encode(self, packet):
+        # Raw bytes are already on-the-wire data
+        if not isinstance(packet, Packet):
+            return packet, False
+        if self.binary:
+            return packet.binary(), True
+        return packet.data, False
+
+    def _encode_frame(self, frame):
+        # A stream frame other than a FileRegion
+        if isinstance(frame, Packet):
+            return encode_frame([frame.binary()]) if self.binary else frame.data
+        return frame
+
+    def _append(self, data, droppable, key, message):
+        self.items.append((data, droppable, key, message))
+        if droppable:
+            self.droppable += 1
+        self._wakeup()
+
+    def _remove_key(self, key):
+        # Returns how many were removed
+        kept = deque()
+        for item in self.items:
+            if item[1] and item[2] == key:
+                self.droppable -= 1
+                self.dropped += 1
+                METRICS.inc('nethub_dropped_total', policy='coalesce')
+            else:
+                kept.append(item)
+        removed = len(self.items) - len(kept)
+        self.items = kept
+        return removed
+
+    def _drop_oldest(self):
+        for i, item in enumerate(self.items):
+            if item[1]:
+                del self.items[i]
+                self.droppable -= 1
+                self.dropped += 1
+                METRICS.inc('nethub_dropped_total', policy='drop_oldest')
+                return
+
+    def _take_all(self):
+        # Caller must be the writer; returns all pending data joined for one write.
+        # Consecutive binary messages share frames of up to BATCH_SIZE.
+        batch = []
+        messages, size = [], 0
+        while self.items:
+            data, droppable, _, message = self.items.popleft()
+            if droppable:
+                self.droppable -= 1
+            if message:
+                messages.append(data)
+                size += len(data)
+                if size < BATCH_SIZE:
+                    continue
+            if messages:
+                batch.append(encode_frame(messages))
+                messages, size = [], 0
+            if not message:
+                batch.append(data)
+        if messages:
+            batch.append(encode_frame(messages))
+        return b"".join(batch)
+
+    def _close_streams(self, stream=None):
+        # Generators close their open files on close()
+        if stream is not None:
+            stream.close()
+        while self.streams:
+            self.streams.popleft().close()
+
+    def _wakeup(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ThreadedClient(OutboundQueue):
+    """Blocking socket with its own writer thread (threaded engine)."""
+    def __init__(self, sock, maxsize=None, policy=None):
+        super().__init__(maxsize, policy)
+        self.sock = sock
+        self.cond = threading.Condition()
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, packet):
+        with self.cond:
+            return super().send(packet)
+
+    def push(self, packet, key=None, snapshot=None):
+        with self.cond:
+            return super().push(packet, key, snapshot)
+
+    def send_stream(self, frames):
+        with self.cond:
+            super().send_stream(frames)
+
+    def use_binary(self):
+        with self.cond:
+            super().use_binary()
+
+    def use_compression(self):
+        with self.cond:
+            super().use_compression()
+
+    def _wakeup(self):
+        # Called with self.cond held
+        self.cond.notify()
+
+    def _writer_loop(self):
+        stream = None
+        try:
+            while True:
+                with self.cond:
+                    while not self.items and not self.streams and stream is None and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    data = self._take_all()
+                    if stream is None and self.streams:
+                        stream = self.streams.popleft()
+                if data:
+                    data = self._deflate(data)
+                    self.sock.sendall(data)
+                    self._sent(len(data))
+                # One frame per pass so queued messages interleave with a transfer
+                if stream is not None:
+                    frame = next(stream, None)
+                    if frame is None:
+                        stream = None
+                    elif isinstance(frame, FileRegion) and (self.deflater is None or not frame.compressible):
+                        # Zero-copy: os.sendfile() where available, send() fallback elsewhere
+                        header = frame.header(self.binary)
+                        self.sock.sendall(header)
+                        self.sock.sendfile(frame.file, frame.offset, frame.count)
+                        self._sent(len(header) + frame.count, frame)
+                        if self.deflater is not None:
+                            COMPRESSION_STATS.add(out_plain=frame.count)
+                    elif isinstance(frame, FileRegion):
+                        data = self._region_bytes(frame)
+                        self.sock.sendall(data)
+                        self._sent(len(data), frame)
+                    else:
+                        data = self._deflate(self._encode_frame(frame))
+                        self.sock.sendall(data)
+                        self._sent(len(data))
+        except OSError:
+            if not self.closed:
+                METRICS.inc('nethub_write_errors_total')
+            self.close()
+        finally:
+            with self.cond:
+                self._close_streams(stream)
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        try:
+            # shutdown() wakes up a reader blocked in recv() on another thread
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class AsyncClient(OutboundQueue):
+    """StreamWriter with a writer task (asyncio engine). Loop thread only."""
+    def __init__(self, writer, maxsize=None, policy=None):
+        super().__init__(maxsize, policy)
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self._writer_loop())
+
+    def _wakeup(self):
+        self.ready.set()
+
+    async def _writer_loop(self):
+        stream = None
+        try:
+            while not self.closed:
+                if stream is None and not self.streams:
+                    await self.ready.wait()
+                self.ready.clear()
+                data = self._take_all()
+                if stream is None and self.streams:
+                    stream = self.streams.popleft()
+                if data:
+                    data = self._deflate(data)
+                    self.writer.write(data)
+                    self._sent(len(data))
+                # One frame per pass so queued messages interleave with a transfer
+                if stream is not None:
+                    frame = next(stream, None)
+                    if frame is None:
+                        stream = None
+                    elif isinstance(frame, FileRegion) and (self.deflater is None or not frame.compressible):
+                        header = frame.header(self.binary)
+                        self.writer.write(header)
+                        await self.writer.drain()
+                        await self.loop.sendfile(self.writer.transport, frame.file,
+                                                 frame.offset, frame.count)
+                        self._sent(len(header) + frame.count, frame)
+                        if self.deflater is not None:
+                            COMPRESSION_STATS.add(out_plain=frame.count)
+                    elif isinstance(frame, FileRegion):
+                        # Reading and deflating a whole chunk would stall the loop
+                        data = await self.loop.run_in_executor(None, self._region_bytes, frame)
+                        self.writer.write(data)
+                        self._sent(len(data), frame)
+                    else:
+                        data = self._deflate(self._encode_frame(frame))
+                        self.writer.write(data)
+                        self._sent(len(data))
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            if not self.closed:
+                METRICS.inc('nethub_write_errors_total')
+            self.close()
+        finally:
+            self._close_streams(stream)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.ready.set()
+        self.writer.close()
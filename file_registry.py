@@ -0,0 +1,112 @@
+import os
+
+from persistence import JournaledStore, writer
+
+
+def file_key(filename, room):
+    # Filenames never contain '/', so the key splits back at its last one
+    return f"{room}/{filename}"
+
+
+class FileRegistry(JournaledStore):
+    """Shared files by room, each naming a blob in a BlobStore.
+
+    Persisted to files_metadata.json as {"room/filename": {"sha256": ..., "size": n}}.
+    The same content shared in several rooms (or under several names) is one
+    blob; blobs are reference counted and removed once nothing refers to them.
+    """
+    def __init__(self, path, blobs, **kwargs):
+        super().__init__(path, **kwargs)
+        self.blobs = blobs
+        self.by_room = {}
+        self.refs = {} # sha256 -> number of entries naming it
+        for key, info in self.data.items():
+            self._index(key, info)
+
+    def adopt_legacy(self, files_dir):
+        """Move files of the old {filename: room} format into the blob store."""
+        with self.lock:
+            for filename, room in list(self.data.items()):
+                if not isinstance(room, str):
+                    continue
+                self._delete(filename)
+                path = os.path.join(files_dir, filename)
+                if os.path.isfile(path):
+                    sha256, size = self.blobs.adopt(path)
+                    info = {'sha256': sha256, 'size': size}
+                    self._set(file_key(filename, room), info)
+                    self._index(file_key(filename, room), info)
+
+    @writer
+    def register(self, filename, room, sha256, size):
+        # Replaces a file of the same name in that room; other rooms are not affected
+        key = file_key(filename, room)
+        info = {'sha256': sha256, 'size': size}
+        with self.lock:
+            old = self.data.get(key)
+            if old == info:
+                return
+            self._set(key, info)
+            self._index(key, info)
+            if old is not None:
+                self._unindex(key, old)
+
+    @writer
+    def unregister(self, filename, room):
+        key = file_key(filename, room)
+        with self.lock:
+            info = self.data.get(key)
+            if info is not None:
+                self._delete(key)
+                self._unindex(key, info)
+
+    def _index(self, key, info):
+        if not isinstance(info, dict):
+            return # Old format, until adopt_legacy()
+        room, _, filename = key.rpartition('/')
+        self.by_room.setdefault(room, set()).add(filename)
+        self.refs[info['sha256']] = self.refs.get(info['sha256'], 0) + 1
+
+    def _unindex(self, key, info):
+        if not isinstance(info, dict):
+            return
+        room, _, filename = key.rpartition('/')
+        files = self.by_room.get(room)
+        if files and key not in self.data:
+            files.discard(filename)
+            if not files:
+                del self.by_room[room]
+        count = self.refs.get(info['sha256'], 0) - 1
+        if count > 0:
+            self.refs[info['sha256']] = count
+            return
+        self.refs.pop(info['sha256'], None)
+        # Replicas leave the blob to the process that persists (see persistence.py)
+        if self.journal is not None:
+            self.blobs.remove(info['sha256'])
+
+    def _apply(self, entry, data=None):
+        if data is not None:
+            return super()._apply(entry, data) # Replaying at load, indexed afterwards
+        key = entry['key']
+        old = self.data.get(key)
+        super()._apply(entry)
+        if not entry.get('deleted'):
+            self._index(key, entry['value'])
+        if old is not None:
+            self._unindex(key, old)
+
+    def lookup(self, filename, room):
+        """{'sha256', 'size'} of a file shared in room, or None."""
+        return self.data.get(file_key(filename, room))
+
+    def can_access(self, filename, room):
+        return self.lookup(filename, room) is not None
+
+    def files_in_room(self, room):
+        with self.lock:
+            return sorted(self.by_room.get(room, ()))
+
+    def live_blobs(self):
+        with self.lock:
+            return set(self.refs)
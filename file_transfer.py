@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+from network_utils import MAX_CHUNK_SIZE, MAX_LINE_SIZE
+from protocol import Packet, payload_header
+from compression import is_compressed_type
+
+# Chunked transfer protocol (binary frames, memory stays bounded by CHUNK_SIZE):
+#   Probe:    UPLOAD_PROBE|name|size|sha256 -> UPLOAD_OK|name if the server has that content,
+#             else UPLOAD_NEED|name|offset and the client uploads it from offset
+#   Upload:   UPLOAD_START|name|size[|sha256|offset], UPLOAD_CHUNK|name|n + n raw bytes, ..., UPLOAD_END|name
+#   Download: DOWNLOAD_STREAM|name[|offset|version] ->
+#             FILE_START|name|size|offset|version, FILE_CHUNK|name|n + n raw bytes, ..., FILE_END|name
+# Transfers are resumable after a dropped connection. An upload is known by
+# its sha256: the server keeps what it got and the next probe tells the
+# client where to go on. A download is resumed by asking for the rest of the
+# same version; if the file changed in between, FILE_START says offset 0.
+CHUNK_SIZE = 64 * 1024
+SENDFILE_CHUNK_SIZE = MAX_CHUNK_SIZE # Server downloads: bigger chunks, fewer sendfile() calls
+# Largest file the legacy DOWNLOAD sends: FILE_DATA|name|<base64> must fit in one line
+MAX_BASE64_FILE_SIZE = (MAX_LINE_SIZE - 4096) // 4 * 3
+
+
+def iter_file_frames(path, name, prefix, chunk_size=CHUNK_SIZE, sha256=None, offset=0):
+    """Yield the encoded frames for sending a file, reading one chunk at a time.
+
+    prefix is 'UPLOAD' (client -> server) or 'FILE' (server -> client).
+    sha256, if given, is sent in the START frame for the receiver to check,
+    along with the offset the upload resumes from.
+    """
+    size = os.path.getsize(path)
+    resume = f"|{sha256}|{offset}" if sha256 else ""
+    yield f"{prefix}_START|{name}|{size}{resume}\n".encode('utf-8')
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield f"{prefix}_CHUNK|{name}|{len(chunk)}\n".encode('utf-8') + chunk
+    yield f"{prefix}_END|{name}\n".encode('utf-8')
+
+
+class FileRegion:
+    """A chunk message whose payload is a byte range of an open file, sent with sendfile()."""
+    __slots__ = ('fields', 'file', 'offset', 'count', 'compressible')
+
+    def __init__(self, fields, file, offset, count, compressible=True):
+        self.fields = fields
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.compressible = compressible # False skips deflate and keeps sendfile()
+
+    def header(self, binary=False):
+        return payload_header(self.fields, self.count, binary)
+
+
+def iter_file_regions(path, name, prefix='FILE', chunk_size=SENDFILE_CHUNK_SIZE, offset=0, version=""):
+    """Like iter_file_frames, but chunks are FileRegions so the file is never read into Python.
+
+    Frames are Packets and FileRegions, encoded by the writer for its connection.
+    Sending starts at offset; version identifies the content for resuming.
+    """
+    compressible = not is_compressed_type(name)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = min(offset, size)
+        yield Packet(f"{prefix}_START", name, str(size), str(offset), version)
+        while offset < size:
+            count = min(chunk_size, size - offset)
+            yield FileRegion((f"{prefix}_CHUNK", name), f, offset, count, compressible)
+            offset += count
+    yield Packet(f"{prefix}_END", name)
+
+
+class IncomingFile:
+    """Writes received chunks straight to a temp file next to final_path."""
+    def __init__(self, final_path, size):
+        self.final_path = final_path
+        self.size = size
+        self.received = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(final_path) or '.',
+                                             prefix='.', suffix='.part')
+        self.f = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.received += len(data)
+        if self.received > self.size:
+            raise ValueError("Received more data than announced")
+        self.f.write(data)
+
+    def finish(self):
+        # Atomically move the complete file into place
+        self.f.close()
+        if self.received != self.size:
+            self.abort()
+            raise ValueError(f"Incomplete file: {self.received}/{self.size} bytes")
+        os.replace(self.tmp_path, self.final_path)
+
+    def abort(self):
+        try:
+            self.f.close()
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,91 @@
+# Server-side tic-tac-toe, one game per room. The server checks every move
+# and tells the room what happened; clients only draw.
+#   Client -> server:  GAME|MOVE|cell     GAME|RESET (players only, while a game is on)
+#                      GAME|STATE (ask for a snapshot)
+#   Server -> room:    GAME|user|MOVE|cell|symbol|outcome   outcome: "", WIN or DRAW
+#                      GAME|user|RESET
+#   Server -> one:     GAME||STATE|x|o|player_x|player_o|turn   (x, o: bitboards)
+#                      GAME||REJECT|reason
+# After a WIN or DRAW the board starts over with both seats free.
+# A sharded server decides every room's moves in the hub (see room_bus.py).
+# Boards are 9-bit ints, bit i = cell i (row by row).
+WIN_LINES = ((0, 1, 2), (3, 4, 5), (6, 7, 8),
+             (0, 3, 6), (1, 4, 7), (2, 5, 8),
+             (0, 4, 8), (2, 4, 6))
+WIN_MASKS = tuple(sum(1 << cell for cell in line) for line in WIN_LINES)
+# Only the lines through the cell just played need checking
+MASKS_BY_CELL = tuple(tuple(m for m in WIN_MASKS if m >> cell & 1) for cell in range(9))
+FULL_BOARD = (1 << 9) - 1
+
+
+class TicTacToe:
+    """The game of one room. Not thread-safe; the server calls it under its lock."""
+    __slots__ = ('x', 'o', 'player_x', 'player_o')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.x = self.o = 0
+        self.player_x = self.player_o = None
+
+    @property
+    def turn(self):
+        return 'X' if bin(self.x).count('1') == bin(self.o).count('1') else 'O'
+
+    @property
+    def in_progress(self):
+        return bool(self.x or self.o or self.player_x or self.player_o)
+
+    def move(self, user, cell):
+        """Play cell for user; returns (symbol, outcome) or raises ValueError with the reason."""
+        if not 0 <= cell < 9:
+            raise ValueError("No such cell")
+        symbol = self.turn
+        seat, other = (self.player_x, self.player_o) if symbol == 'X' else (self.player_o, self.player_x)
+        if seat is None and user == other:
+            raise ValueError("Waiting for an opponent")
+        if seat is not None and seat != user:
+            raise ValueError(f"It's {seat}'s turn")
+        if (self.x | self.o) >> cell & 1:
+            raise ValueError("That cell is taken")
+        return symbol, self.apply(user, cell, symbol)
+
+    def apply(self, user, cell, symbol):
+        # Also used for moves another worker already checked; returns the outcome
+        bit = 1 << cell
+        if symbol == 'X':
+            self.x |= bit
+            self.player_x = self.player_x or user
+            board = self.x
+        else:
+            self.o |= bit
+            self.player_o = self.player_o or user
+            board = self.o
+        if any(board & mask == mask for mask in MASKS_BY_CELL[cell]):
+            outcome = "WIN"
+        elif self.x | self.o == FULL_BOARD:
+            outcome = "DRAW"
+        else:
+            return ""
+        self.reset()
+        return outcome
+
+    def snapshot(self):
+        return (str(self.x), str(self.o), self.player_x or "", self.player_o or "", self.turn)
+
+
+def decide(game, user, action, args):
+    """Play GAME|MOVE|cell or GAME|RESET on game: returns (fields of the delta
+    for the room, None), or (None, reason) for a rejected move."""
+    if action == 'RESET':
+        # Spectators can't call off a game in progress
+        if game.in_progress and user not in (game.player_x, game.player_o):
+            return None, "Only the players can reset the game"
+        game.reset()
+        return ("GAME", user, "RESET"), None
+    try:
+        symbol, outcome = game.move(user, int(args[0]))
+    except ValueError as e:
+        return None, str(e)
+    return ("GAME", user, "MOVE", args[0], symbol, outcome), None
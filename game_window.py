@@ -55,6 +55,9 @@ class TicTacToeWindow:
                                    relief="flat", padx=15, pady=5, cursor="hand2")
         self.btn_reset.pack()
 
+        # The server has the board; ask for it in case a game is under way
+        self.send_func("GAME|STATE")
+
     def on_click(self, index):
         # Access Control
         if self.turn == 'X':
@@ -67,7 +70,8 @@ class TicTacToeWindow:
                 return
 
         if self.board[index] == "":
-            self.send_func(f"GAME|MOVE|{index}|{self.turn}")
+            # Only a request: the server checks it and tells everyone the result
+            self.send_func(f"GAME|MOVE|{index}")
 
     def reset_game(self):
         self.send_func("GAME|RESET")
@@ -92,55 +96,48 @@ class TicTacToeWindow:
         
         try:
             if action == "MOVE":
+                # MOVE|cell|symbol|outcome, already checked by the server
                 idx = int(parts[1])
                 symbol = parts[2]
-                
-                # Assign Roles if empty
-                if symbol == 'X' and self.player_x is None:
+                outcome = parts[3] if len(parts) > 3 else ""
+                if symbol == 'X':
                     self.player_x = sender
-                if symbol == 'O' and self.player_o is None:
+                else:
                     self.player_o = sender
-                
-                # Validate Consistency
-                if symbol == 'X' and self.player_x != sender: return # Ignore invalid X
-                if symbol == 'O' and self.player_o != sender: return # Ignore invalid O
+                self._show_cell(idx, symbol)
 
-                self.board[idx] = symbol
-                
-                color = COLORS["success"] if symbol == 'X' else COLORS["warning"]
-                self.buttons[idx].config(text=symbol, fg=color, bg=COLORS["bg_lighter"])
-                
-                # Check Win
-                if self.check_win(symbol):
-                    if sender == self.username:
-                        self.send_func(f"GAME|WIN|{symbol}|{sender}")
+                if outcome == "WIN":
                     messagebox.showinfo("Game Over", f"Player {symbol} Wins!")
                     self._clear_board()
-                elif "" not in self.board:
-                    if sender == self.username:
-                        self.send_func(f"GAME|DRAW|draw")
+                elif outcome == "DRAW":
                     messagebox.showinfo("Game Over", "It's a Draw!")
                     self._clear_board()
                 else:
                     self.turn = 'O' if symbol == 'X' else 'X'
                     self.update_status()
-                    
+
+            elif action == "STATE":
+                # STATE|x|o|player_x|player_o|turn: the whole board as bitboards
+                x, o = int(parts[1]), int(parts[2])
+                self.player_x = parts[3] or None
+                self.player_o = parts[4] or None
+                self.turn = parts[5]
+                for idx in range(9):
+                    self._show_cell(idx, 'X' if x >> idx & 1 else 'O' if o >> idx & 1 else "")
+                self.update_status()
+
+            elif action == "REJECT":
+                messagebox.showwarning("Tic Tac Toe", parts[1])
+
             elif action == "RESET":
                 self._clear_board()
         except tk.TclError:
             pass # Window likely closed during update
 
-    def check_win(self, p):
-        # Rows, Cols, Diags
-        b = self.board
-        return ((b[0]==p and b[1]==p and b[2]==p) or
-                (b[3]==p and b[4]==p and b[5]==p) or
-                (b[6]==p and b[7]==p and b[8]==p) or
-                (b[0]==p and b[3]==p and b[6]==p) or
-                (b[1]==p and b[4]==p and b[7]==p) or
-                (b[2]==p and b[5]==p and b[8]==p) or
-                (b[0]==p and b[4]==p and b[8]==p) or
-                (b[2]==p and b[4]==p and b[6]==p))
+    def _show_cell(self, idx, symbol):
+        self.board[idx] = symbol
+        color = COLORS["success"] if symbol == 'X' else COLORS["warning"]
+        self.buttons[idx].config(text=symbol, fg=color, bg=COLORS["bg_lighter"])
 
     def _clear_board(self):
         try:
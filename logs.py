@@ -0,0 +1,45 @@
+import logging
+import threading
+import time
+
+# Leveled logging for the server (--log-level). The same message from the
+# same line of code is let through at most BURST times per INTERVAL seconds;
+# the rest are counted and the count is added to the next one let through,
+# so a storm of connection errors can't turn logging into the bottleneck.
+BURST = 10
+INTERVAL = 10.0
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst=BURST, interval=INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.windows = {} # (file, line) -> [window start, let through, suppressed]
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self.windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def setup(level='INFO'):
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(FORMAT))
+    handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,151 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide counters, gauges and histograms, rendered in the Prometheus
+# text format. server.py serves them over HTTP on localhost (--metrics-port):
+#   curl http://127.0.0.1:9100/metrics
+# Names follow the Prometheus conventions (*_total counters, *_seconds times).
+# Labels are keyword arguments; keep their values to a small fixed set.
+TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """Fixed buckets, counted like Prometheus: a value goes in the first bucket >= it."""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(key, extra=()):
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _freeze(value):
+    if isinstance(value, Histogram):
+        return value.buckets, list(value.counts), value.sum, value.count
+    return value
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Registry of named series. Updates take one short lock; reads render everything."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {} # name -> (type, help)
+        self.series = {} # name -> {label pairs: number or Histogram}
+        self.callbacks = {} # name -> fn() giving the current value
+        self.collectors = [] # fn() giving (name, labels, number or Histogram) kept elsewhere
+
+    def describe(self, name, kind, text):
+        self.kinds[name] = (kind, text)
+
+    def track(self, name, fn, text, kind='gauge'):
+        # A value read from elsewhere when rendering, e.g. len(clients)
+        self.describe(name, kind, text)
+        self.callbacks[name] = fn
+
+    def collect(self, fn):
+        # Series kept outside the registry, e.g. under another lock (see profiling.py)
+        self.collectors.append(fn)
+
+    def inc(self, name, amount=1, **labels):
+        # Counters, and gauges kept up to date with +1/-1
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self.lock:
+            series = self.series.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def value(self, name, **labels):
+        """Current value of a counter or gauge series (0 if never set)."""
+        with self.lock:
+            return self.series.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            snapshot = {}
+            for name, series in self.series.items():
+                snapshot[name] = {key: _freeze(v) for key, v in series.items()}
+        for fn in self.collectors:
+            for name, labels, value in fn():
+                snapshot.setdefault(name, {})[tuple(sorted(labels.items()))] = _freeze(value)
+        for name, fn in self.callbacks.items():
+            try:
+                snapshot[name] = {(): fn()}
+            except Exception:
+                continue # A broken callback shouldn't take the endpoint down
+        for name in sorted(snapshot):
+            kind, text = self.kinds.get(name, ('untyped', ''))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(snapshot[name].items()):
+                if not isinstance(value, tuple):
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+                    continue
+                buckets, counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(buckets + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.track('process_start_time_seconds', lambda start=time.time(): start,
+              "Start time of the process since the epoch")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the log
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve METRICS at http://host:port/metrics from a background thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
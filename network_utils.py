@@ -1,17 +1,199 @@
+from compression import Inflater
+
+RECV_SIZE = 64 * 1024
+MAX_LINE_SIZE = 64 * 1024 * 1024 # Guard against a peer that never sends "\n"
+MAX_CHUNK_SIZE = 1024 * 1024 # Reject bigger binary frames so a peer can't make us buffer anything large
+
+# Commands whose header line is followed by a raw payload; the last field is its length
+BINARY_COMMANDS = ('UPLOAD_CHUNK', 'FILE_CHUNK', 'HISTORY', 'DEFLATE')
+_BINARY_PREFIXES = tuple(c + '|' for c in BINARY_COMMANDS)
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+def payload_length(line):
+    """Raw payload size announced by a header line, or None for plain lines."""
+    # Cheap prefix check: never split legacy lines, which may be huge
+    if not line.startswith(_BINARY_PREFIXES):
+        return None
+    length = int(line.rsplit('|', 1)[1])
+    if length < 0 or length > MAX_CHUNK_SIZE:
+        raise ValueError(f"Invalid chunk size: {length}")
+    return length
+
+
+class LineFramer:
+    """Incremental framer for newline-delimited lines and binary frames.
+
+    Bytes live in one bytearray; buf[start:end] is unread data. The "\\n"
+    search resumes where the previous one stopped, so framing a long line
+    costs O(n) in total however many recv() calls it spans. Lines are only
+    decoded once complete, so multibyte UTF-8 split across reads is safe.
+    """
+    def __init__(self, max_line=MAX_LINE_SIZE):
+        self.max_line = max_line
+        self.buf = bytearray()
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+        self.header = None # (line, length) of a binary frame waiting for its payload
+        self.inflater = None # Set by the first DEFLATE frame (see compression.py)
+        self.inflated = None # Framer over the inflated bytes
+
+    def compact(self):
+        if self.start:
+            del self.buf[:self.start]
+            self.end -= self.start
+            self.scan -= self.start
+            self.start = 0
+
+    def reserve(self, size):
+        # Make sure buf has `size` writable bytes after `end`
+        self.compact()
+        spare = len(self.buf) - self.end
+        if spare < size:
+            self.buf.extend(bytes(size - spare))
+        elif spare > 4 * size:
+            # Give back memory left over from a huge line
+            del self.buf[self.end + size:]
+
+    def feed(self, data):
+        self.compact()
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def next_line(self):
+        """Next complete line as str, or None if more data is needed."""
+        idx = self.buf.find(b"\n", self.scan, self.end)
+        if idx < 0:
+            self.scan = self.end
+            if self.end - self.start > self.max_line:
+                raise LineTooLong(f"Line exceeds {self.max_line} bytes")
+            return None
+        line = self.buf[self.start:idx].decode('utf-8', errors='replace')
+        self.start = self.scan = idx + 1
+        return line
+
+    def take(self, n):
+        """Exactly n raw bytes, or None if more data is needed."""
+        if self.end - self.start < n:
+            return None
+        data = bytes(self.buf[self.start:self.start + n])
+        self.start += n
+        self.scan = max(self.scan, self.start)
+        return data
+
+    def next_message(self):
+        """Next (line, payload) pair, or None if more data is needed.
+
+        payload is the raw bytes of a binary frame, or None for plain lines.
+        DEFLATE frames are inflated into an inner framer and never returned;
+        a message may span several consecutive DEFLATE frames.
+        """
+        while True:
+            if self.inflated is not None:
+                msg = self.inflated._next_frame()
+                if msg is not None:
+                    return msg
+            msg = self._next_frame()
+            if msg is None or not self._is_deflate(msg):
+                return msg
+            self.inflate(msg[1])
+
+    def _is_deflate(self, msg):
+        return msg[0].startswith('DEFLATE|')
+
+    def inflate(self, payload):
+        if self.inflater is None:
+            self.inflater = Inflater(self.max_line)
+            self.inflated = type(self)(self.max_line)
+        self.inflated.feed(self.inflater.decompress(payload))
+
+    def _next_frame(self):
+        if self.header is None:
+            line = self.next_line()
+            if line is None:
+                return None
+            length = payload_length(line)
+            if length is None:
+                return line, None
+            self.header = (line, length)
+
+        line, length = self.header
+        payload = self.take(length)
+        if payload is None:
+            return None
+        self.header = None
+        return line, payload
+
+    def messages(self):
+        """All complete messages currently buffered."""
+        batch = []
+        while True:
+            msg = self.next_message()
+            if msg is None:
+                return batch
+            batch.append(msg)
+
+
 class SocketBuffer:
-    def __init__(self, sock):
+    """Blocking reader on top of LineFramer, filled with recv_into()."""
+    def __init__(self, sock, max_line=MAX_LINE_SIZE):
         self.sock = sock
-        self.buffer = ""
+        self.framer = LineFramer(max_line)
+        self.received = 0 # bytes read so far
+
+    def _fill(self):
+        f = self.framer
+        f.reserve(RECV_SIZE)
+        view = memoryview(f.buf)[f.end:f.end + RECV_SIZE]
+        try:
+            n = self.sock.recv_into(view)
+        finally:
+            # The bytearray can't be resized while a view is exported
+            view.release()
+        if not n:
+            return False
+        f.end += n
+        self.received += n
+        return True
+
+    def read_batch(self):
+        """Every message completed by the next recv(), as (line, payload) pairs.
+
+        Returns None once the connection is closed.
+        """
+        while True:
+            batch = self.framer.messages()
+            if batch:
+                return batch
+            try:
+                if not self._fill():
+                    return None
+            except OSError:
+                return None
 
     def read_line(self):
-        while "\n" not in self.buffer:
+        while True:
+            line = self.framer.next_line()
+            if line is not None:
+                return line
             try:
-                data = self.sock.recv(4096).decode('utf-8')
-                if not data:
+                if not self._fill():
                     return None
-                self.buffer += data
-            except:
+            except OSError:
+                return None
+
+    def read_exact(self, n):
+        # Raw payload of a binary frame
+        while True:
+            data = self.framer.take(n)
+            if data is not None:
+                return data
+            try:
+                if not self._fill():
+                    return None
+            except OSError:
                 return None
-        
-        line, self.buffer = self.buffer.split("\n", 1)
-        return line
@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt (memory-hard) when OpenSSL provides it, PBKDF2 otherwise.
+# Parameters are stored with each hash, so they can be raised later.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600_000
+SALT_SIZE = 16
+
+# hashlib releases the GIL while hashing, so threads hash in parallel.
+# The pool size bounds how many hashes (and scrypt's 16 MiB each) run at once.
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+_pool = None
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password):
+    salt = os.urandom(SALT_SIZE)
+    if hasattr(hashlib, 'scrypt'):
+        digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, stored):
+    """Returns (matches, needs_rehash). Comparisons are timing-safe."""
+    fields = stored.split('$')
+    secret = password.encode('utf-8')
+
+    if fields[0] == 'scrypt' and len(fields) == 6:
+        n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+        salt, expected = base64.b64decode(fields[4]), base64.b64decode(fields[5])
+        digest = hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p, dklen=len(expected))
+        outdated = (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return hmac.compare_digest(digest, expected), outdated
+
+    if fields[0] == 'pbkdf2_sha256' and len(fields) == 4:
+        iterations = int(fields[1])
+        salt, expected = base64.b64decode(fields[2]), base64.b64decode(fields[3])
+        digest = hashlib.pbkdf2_hmac('sha256', secret, salt, iterations, dklen=len(expected))
+        outdated = hasattr(hashlib, 'scrypt') or iterations != PBKDF2_ITERATIONS
+        return hmac.compare_digest(digest, expected), outdated
+
+    # Legacy unsalted SHA-256 hex digest
+    digest = hashlib.sha256(secret).hexdigest()
+    return hmac.compare_digest(digest, stored), True
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='hash')
+    return _pool
+
+
+def submit(fn, *args):
+    """Run fn(*args) on the hashing pool; returns a concurrent.futures.Future."""
+    return get_pool().submit(fn, *args)
@@ -0,0 +1,180 @@
+import functools
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 30 # seconds between compactions of a journal into its JSON file
+
+
+def writer(method):
+    """Marks a method that changes the store. In a replica it runs in the
+    process that persists instead, and returns what it returned there."""
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if self.remote is not None:
+            return self.remote(method.__name__, args)
+        return method(self, *args)
+    wrapper.writer = True
+    return wrapper
+
+
+class JournaledStore:
+    """In-memory dict backed by a JSON file, with write-behind persistence.
+
+    The JSON file is read once at startup. Every change is appended as one
+    JSON line to a journal next to it, and a background thread periodically
+    writes an atomic snapshot (temp file + os.replace) and drops the journal.
+    Values are replaced, never mutated in place, so readers need no lock.
+
+    In a sharded server (see room_bus.py) only the parent process persists
+    and writes: forked workers call replicate(), their @writer methods run in
+    the parent, and every change comes back to all workers over the bus.
+    """
+    def __init__(self, path, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.data = self._load()
+        if os.path.exists(self.journal_path + '.old'):
+            # A snapshot was interrupted: what .old held is now only in memory,
+            # and the next rotation would overwrite it. Finish the snapshot first.
+            self._save(self.data)
+            os.remove(self.journal_path + '.old')
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.dirty = False
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.on_change = None # called with every change, e.g. to send it to the replicas
+        self.remote = None # replicas: remote(method name, args) runs a @writer where it persists
+
+    def _load(self):
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except ValueError as e:
+                # Starting empty would overwrite it at the next snapshot
+                log.error("%s is corrupt, refusing to start: %s", self.path, e)
+                raise ValueError(f"{self.path} is not valid JSON: {e}") from e
+        # A crash during snapshot can leave a rotated journal behind
+        for journal in (self.journal_path + '.old', self.journal_path):
+            if not os.path.exists(journal):
+                continue
+            count, good = self._replay(journal, data)
+            if count:
+                self.dirty = True
+            if os.path.getsize(journal) > good:
+                # Cut a torn last entry off, or the next append would be glued to it
+                # and everything after it lost at the following restart
+                log.warning("Dropping a torn entry at the end of %s", journal)
+                os.truncate(journal, good)
+        return data
+
+    def _replay(self, journal, data):
+        # Returns (entries applied, bytes they take up at the start of the journal)
+        count = good = 0
+        with open(journal, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # Torn write at the end of the journal
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(entry, data)
+                count += 1
+                good += len(line)
+        return count, good
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def _set(self, key, value):
+        # Caller must hold self.lock
+        self.data[key] = value
+        self._log({'key': key, 'value': value})
+
+    def _delete(self, key):
+        # Caller must hold self.lock
+        if self.data.pop(key, None) is not None:
+            self._log({'key': key, 'deleted': True})
+
+    def _apply(self, entry, data=None):
+        data = self.data if data is None else data
+        if entry.get('deleted'):
+            data.pop(entry['key'], None)
+        else:
+            data[entry['key']] = entry['value']
+
+    def _log(self, entry):
+        if self.on_change is not None:
+            self.on_change(entry)
+        self._write(entry)
+
+    def _write(self, entry):
+        if self.journal is None:
+            return
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        self.dirty = True
+
+    def apply(self, entry):
+        # A change made by another process; journaled here but not re-announced
+        with self.lock:
+            self._apply(entry)
+            self._write(entry)
+
+    def replicate(self, remote):
+        # In a forked worker: stop touching the parent's files, write through it
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+            self.journal = None
+            self.dirty = False
+            self.remote = remote
+
+    def snapshot(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = dict(self.data)
+            # Rotate the journal so changes made while we write go to a fresh one
+            self.journal.close()
+            os.replace(self.journal_path, self.journal_path + '.old')
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+            self.dirty = False
+
+        self._save(data)
+        os.remove(self.journal_path + '.old')
+
+    def _save(self, data):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+        self.thread.start()
+
+    def _snapshot_loop(self):
+        while not self.stop_event.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except OSError as e:
+                log.error("Snapshot of %s failed: %s", self.path, e)
+
+    def close(self):
+        self.stop_event.set()
+        self.snapshot()
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
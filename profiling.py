@@ -0,0 +1,188 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from metrics import METRICS, Histogram, TIME_BUCKETS
+
+# Profiling a running server, switched on and off without a restart
+# (admin command PROFILE|start|seconds and PROFILE|stop, or SIGUSR2 to toggle):
+#  - ProfiledLock is a drop-in threading.Lock that records, per call site, how
+#    long threads waited for it and how long they held it. The histograms are
+#    in METRICS (nethub_lock_wait_seconds, nethub_lock_hold_seconds) while
+#    recording, which is during a profile or always with LOCK_STATS.
+#  - A sampler thread takes every thread's stack each SAMPLE_INTERVAL. It is
+#    wall clock: threads blocked in recv() or waiting for a lock are counted.
+# On stop both go to PROFILE_DIR: <pid>-<time>.folded holds collapsed stacks
+# ("a;b;c count", read by flamegraph.pl and speedscope) and .locks.txt the
+# lock waits and holds of that profile by call site.
+PROFILE_DIR = 'profiles'
+SAMPLE_INTERVAL = 0.005 # seconds
+MAX_PROFILE_SECONDS = 600 # A forgotten profile stops by itself
+LOCK_STATS = False # --profile-locks: record lock stats all the time
+
+log = logging.getLogger(__name__)
+
+_locks = [] # Every ProfiledLock, to diff their stats over a profile
+_session = None # The running Sampler, if any
+_control = threading.Lock() # Serializes start() and stop()
+
+
+class ProfiledLock:
+    """threading.Lock with wait and hold times per call site ("function:line").
+
+    Stats are only updated by the thread holding the lock, so they need no
+    lock of their own. Not recording costs one flag check per acquire.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.sites = {} # site -> (wait Histogram, hold Histogram)
+        self._held = None # hold Histogram of the current holder's site
+        self._acquired = 0.0
+        _locks.append(self)
+        METRICS.collect(self._collect)
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._acquire(sys._getframe(1), blocking, timeout)
+
+    def __enter__(self):
+        self._acquire(sys._getframe(1), True, -1)
+        return self
+
+    def _acquire(self, frame, blocking, timeout):
+        if not (LOCK_STATS or _session is not None):
+            return self._lock.acquire(blocking, timeout)
+        started = time.perf_counter()
+        if not self._lock.acquire(blocking, timeout):
+            return False
+        self._acquired = time.perf_counter()
+        site = f"{frame.f_code.co_name}:{frame.f_lineno}"
+        stats = self.sites.get(site)
+        if stats is None:
+            stats = self.sites[site] = (Histogram(TIME_BUCKETS), Histogram(TIME_BUCKETS))
+        stats[0].observe(self._acquired - started)
+        self._held = stats[1]
+        return True
+
+    def release(self):
+        held = self._held
+        if held is not None:
+            self._held = None
+            held.observe(time.perf_counter() - self._acquired)
+        self._lock.release()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def totals(self):
+        # site -> (acquisitions, seconds waited, seconds held)
+        return {site: (wait.count, wait.sum, hold.sum) for site, (wait, hold) in list(self.sites.items())}
+
+    def _collect(self):
+        for site, (wait, hold) in list(self.sites.items()):
+            labels = {'lock': self.name, 'site': site}
+            yield 'nethub_lock_wait_seconds', labels, wait
+            yield 'nethub_lock_hold_seconds', labels, hold
+
+
+METRICS.describe('nethub_lock_wait_seconds', 'histogram', "Time spent waiting for a ProfiledLock, by call site")
+METRICS.describe('nethub_lock_hold_seconds', 'histogram', "Time a ProfiledLock was held, by call site")
+
+
+class Sampler:
+    """Counts the stacks of all other threads every `interval` seconds."""
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.locks = {lock: lock.totals() for lock in _locks}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def start(seconds=None):
+    """Start a profile; False if one is already running. Stops itself after `seconds`."""
+    global _session
+    with _control:
+        if _session is not None:
+            return False
+        # Lock stats switch on with _session; start sampling after, so both cover the same time
+        _session = sampler = Sampler()
+        sampler.thread.start()
+    timer = threading.Timer(min(seconds or MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS), _expire, (sampler,))
+    timer.daemon = True
+    timer.start()
+    log.info("Profiling started")
+    return True
+
+
+def _expire(sampler):
+    if _session is sampler:
+        stop()
+
+
+def stop():
+    """Stop the running profile and write it out; returns the .folded path, or None."""
+    global _session
+    with _control:
+        sampler = _session
+        if sampler is None:
+            return None
+        sampler.stop()
+        _session = None
+        path = _write(sampler)
+    log.info("Profile written to %s", path)
+    return path
+
+
+def toggle():
+    # For a signal handler: start a profile, or stop and save the running one
+    if stop() is None:
+        start()
+
+
+def _write(sampler):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = time.time()
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    base = os.path.join(PROFILE_DIR, f"{os.getpid()}-{stamp}")
+    with open(base + '.folded', 'w', encoding='utf-8') as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(base + '.locks.txt', 'w', encoding='utf-8') as f:
+        f.write(f"# {time.time() - sampler.started:.1f}s, {sampler.samples} samples\n")
+        f.write("# lock site acquisitions wait_s hold_s (most waited first)\n")
+        for lock, before in sampler.locks.items():
+            rows = []
+            for site, (count, waited, held) in lock.totals().items():
+                old = before.get(site, (0, 0.0, 0.0))
+                if count > old[0]:
+                    rows.append((waited - old[1], site, count - old[0], held - old[2]))
+            for waited, site, count, held in sorted(rows, reverse=True):
+                f.write(f"{lock.name} {site} {count} {waited:.6f} {held:.6f}\n")
+    return base + '.folded'
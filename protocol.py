@@ -0,0 +1,182 @@
+import struct
+from collections import deque
+
+from network_utils import LineFramer, MAX_LINE_SIZE, BINARY_COMMANDS
+
+# Two wire formats share one port.
+#
+# Text (default): "CMD|field|field\n"; commands in BINARY_COMMANDS end with a
+# length field and are followed by that many raw bytes.
+#
+# Binary: a client sends the text line "PROTOCOL|binary"; the server answers
+# with the same line and from then on both sides only send frames:
+#   frame   = u32 length, then that many bytes of messages
+#   message = u8 opcode, u8 field count, then per field: u32 length + bytes
+# Fields may contain "|" and "\n". A frame carries any number of messages,
+# so everything queued for a connection goes out in one frame per write.
+# Opcode 0 means the command name is sent as the first field.
+# The raw payload of a BINARY_COMMANDS message is simply its last field.
+OPCODES = (
+    None,
+    # Client -> server
+    'PROTOCOL', 'REGISTER', 'LOGIN', 'JOIN_ROOM', 'USERLIST', 'MSG', 'GAME',
+    'UPLOAD', 'DOWNLOAD', 'LIST_FILES', 'UPLOAD_START', 'UPLOAD_CHUNK', 'UPLOAD_END',
+    'DOWNLOAD_STREAM', 'HISTORY_BEFORE',
+    # Server -> client
+    'REGISTER_SUCCESS', 'REGISTER_FAIL', 'LOGIN_SUCCESS', 'LOGIN_FAIL', 'ROOM_JOINED',
+    'USERLIST_ADMIN', 'PRESENCE', 'PRESENCE_ADMIN', 'SERVER', 'FILE_NOTIF', 'FILE_DATA',
+    'FILE_LIST', 'FILE_START', 'FILE_CHUNK', 'FILE_END', 'UPLOAD_OK', 'UPLOAD_FAIL', 'HISTORY',
+    # Both ways
+    'DEFLATE',
+    # Added later, at the end so earlier opcodes keep their numbers
+    'UPLOAD_PROBE', 'UPLOAD_NEED',
+)
+OPCODE_OF = {name: code for code, name in enumerate(OPCODES) if name}
+MAX_FRAME_SIZE = MAX_LINE_SIZE
+BATCH_SIZE = 256 * 1024 # Queued messages are packed into frames of about this size
+
+_u32 = struct.Struct('>I')
+_header = struct.Struct('>BB')
+
+
+def _message_head(fields, extra):
+    # Opcode, field count and text fields; `extra` more fields follow
+    opcode = OPCODE_OF.get(fields[0], 0)
+    values = [f.encode('utf-8') for f in (fields[1:] if opcode else fields)]
+    out = [_header.pack(opcode, len(values) + extra)]
+    for value in values:
+        out.append(_u32.pack(len(value)))
+        out.append(value)
+    return b"".join(out)
+
+
+def encode_message(fields, payload=None):
+    """One binary message (no frame header)."""
+    if payload is None:
+        return _message_head(fields, 0)
+    return _message_head(fields, 1) + _u32.pack(len(payload)) + payload
+
+
+def payload_header(fields, length, binary=False):
+    """Bytes to send before `length` payload bytes that are sent separately (sendfile)."""
+    if not binary:
+        return ("|".join(fields) + f"|{length}\n").encode('utf-8')
+    head = _message_head(fields, 1) + _u32.pack(length)
+    return _u32.pack(len(head) + length) + head
+
+
+def encode_frame(messages):
+    """Wrap encoded messages in one frame."""
+    body = b"".join(messages)
+    return _u32.pack(len(body)) + body
+
+
+def deflate_frame(data, binary=False):
+    """A DEFLATE frame around compressed bytes (see compression.py)."""
+    if binary:
+        return encode_frame([encode_message(('DEFLATE',), data)])
+    return payload_header(('DEFLATE',), len(data)) + data
+
+
+def decode_messages(body):
+    """(fields, payload) for every message in a frame body."""
+    messages = []
+    view = memoryview(body)
+    pos = 0
+    while pos < len(body):
+        if pos + 2 > len(body):
+            raise ValueError("Message header runs past the end of the frame")
+        opcode, count = _header.unpack_from(body, pos)
+        pos += 2
+        values = []
+        for _ in range(count):
+            if pos + 4 > len(body):
+                raise ValueError("Field length runs past the end of the frame")
+            (length,) = _u32.unpack_from(body, pos)
+            pos += 4
+            if pos + length > len(body):
+                raise ValueError("Field runs past the end of the frame")
+            values.append(view[pos:pos + length])
+            pos += length
+        if opcode:
+            if opcode >= len(OPCODES):
+                raise ValueError(f"Unknown opcode: {opcode}")
+            command = OPCODES[opcode]
+        else:
+            command = bytes(values.pop(0)).decode('utf-8', errors='replace')
+        payload = None
+        if command in BINARY_COMMANDS and values:
+            payload = bytes(values.pop())
+        fields = [command] + [bytes(v).decode('utf-8', errors='replace') for v in values]
+        messages.append((fields, payload))
+    return messages
+
+
+class Packet:
+    """One protocol message, encoded once per wire format and shared by every recipient.
+
+    `payload` is the raw data of a BINARY_COMMANDS message. `data` is the text
+    encoding; the binary one is built the first time a binary client needs it.
+    """
+    __slots__ = ('fields', 'payload', 'data', '_binary')
+
+    def __init__(self, *fields, payload=None):
+        self.fields = fields
+        self.payload = payload
+        line = "|".join(fields)
+        if "\n" in line:
+            # Text clients can't take a newline inside a message
+            line = line.replace("\n", " ")
+        if payload is None:
+            self.data = (line + "\n").encode('utf-8')
+        else:
+            self.data = payload_header((line,), len(payload)) + payload
+        self._binary = None
+
+    def binary(self):
+        if self._binary is None:
+            self._binary = encode_message(self.fields, self.payload)
+        return self._binary
+
+    def __len__(self):
+        return len(self.data)
+
+
+class BinaryFramer(LineFramer):
+    """Framer for binary connections, same buffer handling as LineFramer.
+
+    next_message() returns (fields, payload) with fields already split.
+    """
+    def __init__(self, max_frame=MAX_FRAME_SIZE):
+        super().__init__(max_frame)
+        self.pending = deque() # Decoded messages of the current frame
+
+    @classmethod
+    def take_over(cls, framer):
+        # Continue with whatever the text framer had buffered
+        new = cls(framer.max_line)
+        if framer.inflater is not None:
+            # The deflate stream goes on across the switch
+            new.inflater = framer.inflater
+            new.inflated = cls(framer.max_line)
+        new.feed(bytes(framer.buf[framer.start:framer.end]))
+        return new
+
+    def _is_deflate(self, msg):
+        return msg[0][0] == 'DEFLATE'
+
+    def _next_frame(self):
+        while not self.pending:
+            available = self.end - self.start
+            if available < 4:
+                return None
+            (length,) = _u32.unpack_from(self.buf, self.start)
+            if length > self.max_line:
+                raise ValueError(f"Frame exceeds {self.max_line} bytes")
+            if available < 4 + length:
+                return None
+            body = bytes(self.buf[self.start + 4:self.start + 4 + length])
+            self.start += 4 + length
+            self.scan = self.start
+            self.pending.extend(decode_messages(body))
+        return self.pending.popleft()
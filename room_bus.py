@@ -0,0 +1,288 @@
+import json
+import logging
+from concurrent.futures import Future
+import os
+import socket
+import threading
+
+from connections import ThreadedClient
+from game_engine import TicTacToe, decide
+from protocol import Packet
+from network_utils import SocketBuffer
+
+log = logging.getLogger(__name__)
+
+# Local message bus between the worker processes of a sharded server
+# (server.py --workers N). One JSON array per line, so "|" and newlines
+# from binary clients can't break the framing:
+#   ["HELLO", worker]                  first line from every worker
+#   ["PUB", room, fields]              room broadcast, delivered to members on other workers
+#   ["POST", room, fields]             a PUB the hub also keeps in the room's history
+#   ["HISTORY", id, room, before, n]   a page of a room's history, answered with RESULT
+#   ["PLAY", room, user, action, args, ticket]  a GAME move or reset, decided by the hub
+#   ["GAME", room, fields]             the hub's game delta (see game_engine.py), to every worker
+#   ["PLAYED", ticket, reason]         back to the worker that sent PLAY; reason if rejected
+#   ["MEMBERS", room, worker, entries] a worker's members of a room (["user#ip:port", ...])
+#   ["CALL", id, name, method, args]   a @writer of a JournaledStore, run by the hub
+#   ["RESULT", id, result, error]      the outcome of a CALL or HISTORY, back to the worker that asked
+#   ["STORE", name, entry]             a change to a JournaledStore (see persistence.py), from the hub
+#   ["GONE", worker]                   sent by the hub when a worker disconnects
+# Sends are queued on a ThreadedClient, so publishing never blocks a caller
+# that holds the server lock.
+
+
+def encode(*message):
+    return (json.dumps(message) + "\n").encode('utf-8')
+
+
+class BusHub:
+    """Relays bus lines between workers. Runs in the parent process.
+
+    Room broadcasts only go to workers with members in that room; everything
+    else goes to all the other workers. The hub's stores are the only ones
+    written to: workers CALL their @writer methods here, so concurrent writes
+    (two workers registering one name) are decided in one place, and each
+    change goes out as STORE to every worker. For the same reason the hub
+    owns every room's game and sends out the moves it accepts, which the
+    workers apply to their copies; a game ends once no worker has members
+    in its room. Room history (see room_history.py) is kept here as well, so
+    every worker backfills a joiner with the same entries and ids, whichever
+    worker they were posted on. The hub also keeps the latest
+    MEMBERS line per room and worker so a worker that connects late (or goes
+    away) can be brought up to date.
+    """
+    def __init__(self, path, stores, history):
+        self.path = path
+        self.stores = stores # name -> JournaledStore
+        self.history = history # RoomHistory
+        self.lock = threading.Lock()
+        self.peers = {} # ThreadedClient -> worker id
+        self.members = {} # (room, worker) -> encoded MEMBERS line
+        self.room_workers = {} # room -> workers with members in it
+        self.games = {} # room -> TicTacToe
+        for name, store in stores.items():
+            store.on_change = lambda entry, name=name: self._relay(None, encode('STORE', name, entry))
+        if os.path.exists(path):
+            os.remove(path)
+        # Listening before the workers are forked, so they can connect right away
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _relay(self, sender, data, room=None):
+        with self.lock:
+            if room is None:
+                peers = [p for p in self.peers if p is not sender]
+            else:
+                workers = self.room_workers.get(room, ())
+                peers = [p for p, w in self.peers.items() if p is not sender and w in workers]
+        for peer in peers:
+            try:
+                peer.send(data)
+            except ConnectionError:
+                pass
+
+    def _serve(self, sock):
+        peer = ThreadedClient(sock)
+        buf = SocketBuffer(sock)
+        worker = None
+        try:
+            while True:
+                line = buf.read_line()
+                if line is None:
+                    break
+                data = (line + "\n").encode('utf-8')
+                kind, *args = json.loads(line)
+                if kind == 'HELLO':
+                    worker = args[0]
+                    with self.lock:
+                        self.peers[peer] = worker
+                        for known in self.members.values():
+                            peer.send(known)
+                    continue
+                if kind == 'PUB':
+                    self._relay(peer, data, args[0])
+                    continue
+                if kind == 'POST':
+                    room, fields = args
+                    # Entries are text lines, whatever format the sender used
+                    self.history.record(room, Packet(*fields).data[:-1].decode('utf-8'))
+                    self._relay(peer, encode('PUB', room, fields), room)
+                    continue
+                if kind == 'HISTORY':
+                    call_id, room, before_id, limit = args
+                    peer.send(encode('RESULT', call_id, self.history.page(room, before_id, limit), None))
+                    continue
+                if kind == 'CALL':
+                    self._call(peer, *args)
+                    continue
+                if kind == 'PLAY':
+                    self._play(peer, *args)
+                    continue
+                if kind == 'MEMBERS':
+                    room, member_of, entries = args
+                    with self.lock:
+                        if entries:
+                            self.members[(room, member_of)] = data
+                            self.room_workers.setdefault(room, set()).add(member_of)
+                        else:
+                            self._forget(room, member_of)
+                self._relay(peer, data)
+        except Exception as e:
+            log.error("Room bus error (worker %s): %s", worker, e)
+        finally:
+            with self.lock:
+                self.peers.pop(peer, None)
+                for room, member_of in [k for k in self.members if k[1] == worker]:
+                    self._forget(room, member_of)
+            peer.close()
+            if worker is not None:
+                self._relay(peer, encode('GONE', worker))
+
+    def _call(self, peer, call_id, name, method, args):
+        # The STOREs of the change are queued to every worker before the RESULT
+        fn = getattr(self.stores[name], method)
+        result = error = None
+        try:
+            if not getattr(fn, 'writer', False):
+                raise ValueError(f"{name}.{method} is not a store write")
+            result = fn(*args)
+        except Exception as e:
+            log.error("Store write %s.%s failed: %s", name, method, e)
+            error = str(e)
+        peer.send(encode('RESULT', call_id, result, error))
+
+    def _play(self, peer, room, user, action, args, ticket):
+        with self.lock:
+            game = self.games.get(room)
+            if game is None:
+                game = self.games[room] = TicTacToe()
+            fields, reason = decide(game, user, action, args)
+            if fields:
+                # Under the lock, so every worker gets the moves in the order they were played
+                self._send_all(encode('GAME', room, fields))
+        peer.send(encode('PLAYED', ticket, reason))
+
+    def _send_all(self, data):
+        # Caller must hold self.lock
+        for peer in self.peers:
+            try:
+                peer.send(data)
+            except ConnectionError:
+                pass
+
+    def _forget(self, room, worker):
+        # Caller must hold self.lock
+        self.members.pop((room, worker), None)
+        workers = self.room_workers.get(room)
+        if workers:
+            workers.discard(worker)
+            if not workers:
+                del self.room_workers[room]
+                if self.games.pop(room, None) is not None:
+                    # Nobody left to play; workers drop their copy with the room too
+                    self._send_all(encode('GAME', room, ("GAME", "", "RESET")))
+
+    def close(self):
+        self.server.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RoomBus:
+    """A worker's connection to the hub.
+
+    handler(message) is called for every message from the other workers, through
+    dispatch(fn, *args): a plain call by default, loop.call_soon_threadsafe
+    for the asyncio engine so handlers run on the loop. STORE changes are
+    applied to `stores` by the reader thread itself, so a write made with
+    call() is in this worker's replica by the time call() returns.
+    """
+    def __init__(self, path, worker, handler, stores):
+        self.worker = str(worker)
+        self.handler = handler
+        self.stores = stores
+        self.calls = {} # call id -> Future of a CALL waiting for its RESULT
+        self.plays = {} # ticket -> on_reject of a PLAY waiting for PLAYED
+        self.next_call = 0
+        self.calls_lock = threading.Lock()
+        self.dispatch = lambda fn, *args: fn(*args)
+        self.on_lost = None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self.reader = SocketBuffer(sock)
+        self.conn = ThreadedClient(sock)
+        self.conn.traffic = 'bus'
+        self.conn.send(encode('HELLO', self.worker))
+
+    def start(self):
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def publish(self, room, packet, record=False):
+        # record: also keep it in the room's history (MSG, FILE_NOTIF)
+        self.conn.send(encode('POST' if record else 'PUB', room, packet.fields))
+
+    def play(self, room, user, action, args, on_reject):
+        # Accepted moves come back as GAME through handler; on_reject(reason) otherwise
+        with self.calls_lock:
+            self.next_call += 1
+            ticket = self.next_call
+            self.plays[ticket] = on_reject
+        self.conn.send(encode('PLAY', room, user, action, list(args), ticket))
+
+    def publish_members(self, room, entries):
+        self.conn.send(encode('MEMBERS', room, self.worker, list(entries)))
+
+    def request(self, kind, *args):
+        """Send a CALL or HISTORY; returns a Future of the hub's RESULT
+        (ValueError if it failed there)."""
+        future = Future()
+        with self.calls_lock:
+            self.next_call += 1
+            call_id = self.next_call
+            self.calls[call_id] = future
+        self.conn.send(encode(kind, call_id, *args))
+        return future
+
+    def call(self, name, method, args):
+        """Run a @writer of store `name` in the hub and return its result."""
+        return self.request('CALL', name, method, list(args)).result()
+
+    def _read_loop(self):
+        while True:
+            line = self.reader.read_line()
+            if line is None:
+                break
+            kind, *args = message = json.loads(line)
+            if kind == 'STORE':
+                self.stores[args[0]].apply(args[1])
+            elif kind == 'RESULT':
+                with self.calls_lock:
+                    future = self.calls.pop(args[0])
+                if args[2] is not None:
+                    future.set_exception(ValueError(args[2]))
+                else:
+                    future.set_result(args[1])
+            elif kind == 'PLAYED':
+                with self.calls_lock:
+                    on_reject = self.plays.pop(args[0])
+                if args[1] is not None:
+                    self.dispatch(on_reject, args[1])
+            else:
+                self.dispatch(self.handler, message)
+        log.error("Worker %s lost the room bus", self.worker)
+        if self.on_lost:
+            self.on_lost()
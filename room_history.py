@@ -0,0 +1,195 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from network_utils import MAX_CHUNK_SIZE
+from protocol import Packet
+
+# Recent MSG/FILE_NOTIF lines per room, replayed to whoever joins.
+#   JOIN_ROOM          -> HISTORY|room|more|n + n bytes of "id|timestamp|line\n" entries
+#   HISTORY_BEFORE|id  -> the same frame with up to PAGE_SIZE entries older than id
+# `more` is 1 when older entries exist; ids increase by one per room.
+HISTORY_BYTES = 256 * 1024 # In-memory budget per room
+BACKFILL_COUNT = 50 # Entries sent on JOIN_ROOM
+PAGE_SIZE = 50
+MAX_ENTRY_SIZE = 64 * 1024 # Bigger messages are delivered but not kept
+MAX_ROOM_LOGS = 1000 # Rooms kept in memory, least recently used are dropped
+
+# On-disk log (optional): <dir>/<room hash>/<first id>.log, append-only
+# segments of SEGMENT_ENTRIES lines. Starting a new segment drops the
+# oldest ones beyond RETAIN_SEGMENTS.
+SEGMENT_ENTRIES = 1000
+RETAIN_SEGMENTS = 50
+
+
+def history_frame(room, entries, more):
+    payload = "".join(e + "\n" for e in entries).encode('utf-8')
+    return Packet("HISTORY", room, str(int(more)), payload=payload)
+
+
+def _entry_id(entry):
+    return int(entry.split('|', 1)[0])
+
+
+class RoomLog:
+    """History of one room: a byte-bounded ring of the newest entries,
+    optionally backed by segment files for paging further back."""
+    def __init__(self, directory=None):
+        self.lock = threading.Lock()
+        self.ring = deque() # (id, entry), oldest first
+        self.ring_bytes = 0
+        self.next_id = 1
+        self.directory = directory
+        self.segments = [] # first id of every segment file, ascending
+        self.file = None
+        self.file_entries = 0
+        if directory:
+            self._load()
+
+    def _segment_path(self, first_id):
+        return os.path.join(self.directory, f"{first_id:012d}.log")
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log'))
+        if not self.segments:
+            return
+        path = self._segment_path(self.segments[-1])
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                # Torn write at the end: drop the partial entry
+                data = data[:data.rfind(b"\n") + 1]
+                f.truncate(len(data))
+        entries = data.decode('utf-8', errors='replace').splitlines()
+        self.file_entries = len(entries)
+        self.next_id = _entry_id(entries[-1]) + 1 if entries else self.segments[-1]
+        for entry in entries:
+            self._remember(_entry_id(entry), entry)
+
+    def _remember(self, entry_id, entry):
+        self.ring.append((entry_id, entry))
+        self.ring_bytes += len(entry)
+        while self.ring_bytes > HISTORY_BYTES:
+            self.ring_bytes -= len(self.ring.popleft()[1])
+
+    def append(self, line):
+        # Caller must hold self.lock
+        entry_id = self.next_id
+        self.next_id += 1
+        entry = f"{entry_id}|{int(time.time())}|{line}"
+        self._remember(entry_id, entry)
+        if self.directory:
+            self._write(entry_id, entry)
+        return entry_id
+
+    def _write(self, entry_id, entry):
+        if not self.segments or self.file_entries >= SEGMENT_ENTRIES:
+            if self.file:
+                self.file.close()
+                self.file = None
+            self.segments.append(entry_id)
+            self.file_entries = 0
+            self._compact()
+        if self.file is None:
+            self.file = open(self._segment_path(self.segments[-1]), 'a', encoding='utf-8')
+        self.file.write(entry + "\n")
+        self.file.flush()
+        self.file_entries += 1
+
+    def _compact(self):
+        # Whole segments are dropped, so no file is ever rewritten
+        while len(self.segments) > RETAIN_SEGMENTS:
+            try:
+                os.remove(self._segment_path(self.segments.pop(0)))
+            except OSError:
+                pass
+
+    def _first_id(self):
+        # Oldest entry still available
+        if self.segments:
+            return self.segments[0]
+        return self.ring[0][0] if self.ring else self.next_id
+
+    def _read_before(self, upto, limit):
+        # Walk segments backwards from the one holding upto - 1
+        found = []
+        index = bisect.bisect_left(self.segments, upto) - 1
+        while index >= 0 and len(found) < limit:
+            try:
+                with open(self._segment_path(self.segments[index]), 'r', encoding='utf-8', errors='replace') as f:
+                    older = [e for e in f.read().splitlines() if _entry_id(e) < upto]
+            except (OSError, ValueError):
+                break
+            found = older + found
+            index -= 1
+        return found[-limit:]
+
+    def before(self, before_id, limit):
+        """Up to `limit` entries older than before_id (None: newest), plus whether more exist."""
+        if before_id is None:
+            before_id = self.next_id
+        found = [e for i, e in self.ring if i < before_id]
+        oldest_in_ring = self.ring[0][0] if self.ring else self.next_id
+        if len(found) < limit and self.directory:
+            upto = min(before_id, oldest_in_ring)
+            found = self._read_before(upto, limit - len(found)) + found
+        found = found[-limit:]
+
+        # Keep the frame under the framer's payload limit
+        size = sum(len(e) + 1 for e in found)
+        while found and size > MAX_CHUNK_SIZE - 1024:
+            size -= len(found.pop(0)) + 1
+        first = _entry_id(found[0]) if found else before_id
+        return found, first > self._first_id()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class RoomHistory:
+    """RoomLogs by room name, with at most MAX_ROOM_LOGS held in memory."""
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.logs = OrderedDict()
+
+    def _get(self, room):
+        with self.lock:
+            log = self.logs.get(room)
+            if log is not None:
+                self.logs.move_to_end(room)
+                return log
+            path = None
+            if self.directory:
+                # Room names are arbitrary text; hash them into a safe directory name
+                path = os.path.join(self.directory, hashlib.sha1(room.encode('utf-8')).hexdigest())
+            log = self.logs[room] = RoomLog(path)
+            if len(self.logs) > MAX_ROOM_LOGS:
+                _, evicted = self.logs.popitem(last=False)
+                with evicted.lock:
+                    evicted.close()
+            return log
+
+    def record(self, room, line):
+        if len(line) > MAX_ENTRY_SIZE:
+            return None
+        log = self._get(room)
+        with log.lock:
+            return log.append(line)
+
+    def page(self, room, before_id=None, limit=BACKFILL_COUNT):
+        log = self._get(room)
+        with log.lock:
+            return log.before(before_id, limit)
+
+    def close(self):
+        with self.lock:
+            for log in self.logs.values():
+                with log.lock:
+                    log.close()
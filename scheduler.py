@@ -0,0 +1,42 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ThreadScheduler:
+    """One background thread running delayed callbacks (threaded engine).
+
+    Same call_later(delay, callback, *args) signature as an asyncio loop, so
+    server code can schedule work without knowing which engine runs it.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count() # tie-breaker, callbacks aren't comparable
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay, callback, *args):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.counter), callback, args))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                when, _, callback, args = self.heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+            try:
+                callback(*args)
+            except Exception as e:
+                log.exception("Scheduled callback failed: %s", e)
@@ -1,83 +1,109 @@
 import socket
 import threading
-import json
-import hashlib
 import os
 import base64
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import connections
+from connections import ThreadedClient, AsyncClient, Packet
+from file_transfer import iter_file_regions, MAX_BASE64_FILE_SIZE
+from blob_store import BlobStore
+from network_utils import SocketBuffer, LineFramer, RECV_SIZE
+from protocol import BinaryFramer, OPCODE_OF
+from room_bus import BusHub, RoomBus
+from room_history import RoomHistory, history_frame, BACKFILL_COUNT, PAGE_SIZE
+from scheduler import ThreadScheduler
+from user_store import UserStore
+from file_registry import FileRegistry
+from game_engine import TicTacToe, decide
+import passwords
+import compression
+import logs
+import metrics
+import profiling
+from metrics import METRICS, SIZE_BUCKETS
+from passwords import hash_password, verify_password
+
+log = logging.getLogger('server') # Run as a script, __name__ would be __main__
 
 # Configuration
 HOST = '127.0.0.1'
 PORT = 55555
 FILES_DIR = 'server_files'
+BLOBS_DIR = os.path.join(FILES_DIR, 'blobs') # Content-addressed, see blob_store.py
 USERS_FILE = 'users.json'
 
+# Server engines: 'threaded' (one thread per client) or 'asyncio' (single event loop)
+ENGINES = ('threaded', 'asyncio')
+DEFAULT_ENGINE = 'threaded'
+LISTEN_BACKLOG = 1024
+PRESENCE_WINDOW = 0.1 # seconds; joins/leaves within it are announced together (0 = immediately)
+# Sharded mode (--workers N): N processes share the port with SO_REUSEPORT
+# and relay room traffic over a Unix socket bus run by the parent
+BUS_PATH = 'room_bus.sock'
+
 if not os.path.exists(FILES_DIR):
     os.makedirs(FILES_DIR)
 
 FILES_METADATA_FILE = 'files_metadata.json'
+FILE_WORKERS = 2 # Threads for slow file work, e.g. re-hashing a resumed upload
 
-# --- File Metadata Management ---
-def load_files_metadata():
-    if not os.path.exists(FILES_METADATA_FILE):
-        return {}
-    try:
-        with open(FILES_METADATA_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_files_metadata(metadata):
-    with open(FILES_METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=4)
-
-def register_file(filename, room):
-    metadata = load_files_metadata()
-    metadata[filename] = room
-    save_files_metadata(metadata)
-
-def can_access_file(filename, user_room):
-    metadata = load_files_metadata()
-    if filename not in metadata:
-        return False # OR True if we want global legacy files, but safer to default False
-    return metadata[filename] == user_room
-
-# --- User Management (JSON) ---
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    try:
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return {}
+# --- File Metadata Management (in-memory, persisted by FileRegistry) ---
+blobs = BlobStore(BLOBS_DIR)
+file_registry = FileRegistry(FILES_METADATA_FILE, blobs)
+# Kept apart from the password hashing pool, so big files can't hold up logins
+# (threads start on first use, after any fork)
+file_pool = ThreadPoolExecutor(max_workers=FILE_WORKERS, thread_name_prefix='file')
+
+def register_file(filename, room, sha256, size, then):
+    # Calls then() once the file is registered. In sharded mode the hub does
+    # that: returns a (future, continuation) pair like REGISTER, so the
+    # engine waits for the hub without blocking anyone else
+    if bus is not None:
+        return (bus.request('CALL', 'files', 'register', [filename, room, sha256, size]),
+                lambda _: then())
+    file_registry.register(filename, room, sha256, size)
+    then()
 
-def save_users(users_data):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users_data, f, indent=4)
+# --- User Management (in-memory, persisted by UserStore) ---
+user_store = UserStore(USERS_FILE)
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Replicated between worker processes in sharded mode, by name
+stores = {'users': user_store, 'files': file_registry}
 
+def valid_name(name):
+    # User and room names end up in member entries ("user#ip:port") and
+    # comma-separated lists, so those separators and control characters are out
+    return bool(name) and not any(c in '|,#' or c < ' ' or c == '\x7f' for c in name)
+
+# Both run on the hashing pool (passwords.submit), never on a connection handler
 def register_user(username, password):
-    users = load_users()
-    if username in users:
-        return False
+    if user_store.get(username) is not None:
+        return False # Don't spend a hash on a taken name
     # New format with role
-    users[username] = {
+    return user_store.add(username, {
         "password": hash_password(password),
         "role": "user"
-    }
-    save_users(users)
-    return True
+    })
+
+_dummy_hash = None
 
 def login_user(username, password):
-    users = load_users()
-    if username not in users:
+    global _dummy_hash
+    user_obj = user_store.get(username)
+    if user_obj is None:
+        # Hash anyway so unknown usernames can't be told apart by timing
+        if _dummy_hash is None:
+            _dummy_hash = hash_password("dummy")
+        verify_password(password, _dummy_hash)
         return False, None
     
-    hashed = hash_password(password)
-    user_obj = users[username]
-    
     # Backward compatibility
     if isinstance(user_obj, str):
         stored_pass = user_obj
@@ -86,234 +112,949 @@ def login_user(username, password):
         stored_pass = user_obj["password"]
         role = user_obj["role"]
 
-    if hashed == stored_pass:
-        return True, role
-    return False, None
+    matches, needs_rehash = verify_password(password, stored_pass)
+    if not matches:
+        return False, None
+    if needs_rehash:
+        # Transparently upgrade legacy SHA-256 (and outdated KDF) entries
+        user_store.update(username, {"password": hash_password(password), "role": role})
+    return True, role
+
+# Constant replies, encoded once at startup
+REGISTER_SUCCESS = Packet("REGISTER_SUCCESS")
+REGISTER_FAIL_TAKEN = Packet("REGISTER_FAIL", "Username taken")
+REGISTER_FAIL_INVALID = Packet("REGISTER_FAIL", "Username can't contain | , # or control characters")
+INVALID_ROOM = Packet("SERVER", "Room names can't contain | , # or control characters")
+LOGIN_FAIL_INVALID = Packet("LOGIN_FAIL", "Invalid credentials")
+ACCESS_DENIED = Packet("SERVER", "Access Denied or File Not Found.")
+TOO_LARGE_FOR_DOWNLOAD = Packet("SERVER", "File too large for DOWNLOAD, use DOWNLOAD_STREAM.")
+PROTOCOL_BINARY = Packet("PROTOCOL", "binary")
+PROTOCOL_TEXT = Packet("PROTOCOL", "text")
 
 # --- Global State ---
-clients = {} # socket -> {'username': str, 'room': str, 'role': str, 'addr': tuple}
-lock = threading.Lock()
+clients = {} # connection -> {'username': str, 'room': str, 'role': str, 'addr': tuple}
+lock = profiling.ProfiledLock('global') # A threading.Lock that can time its waits (see profiling.py)
+
+class Room:
+    def __init__(self):
+        # Copy-on-write snapshot, replaced (never mutated) under `lock`
+        # so broadcasts can iterate it without taking the global lock
+        self.members = ()
+        # Membership as last announced: client -> (username, "username#ip:port").
+        # Bumped `version` on every announcement; clients use it to spot missed deltas
+        self.published = {}
+        self.version = 0
+        self.flush_pending = False
+        # Sharded mode: members on other workers, worker -> {(worker, entry): (username, entry)},
+        # and our own member entries as last published on the bus
+        self.remote = {}
+        self.shared = ()
+        self.game = TicTacToe() # Ends when the room empties
+
+rooms = {} # room name -> Room
+uploads = {} # connection -> in-progress chunked upload, only touched by its reader
+history = RoomHistory() # Recent MSG/FILE_NOTIF per room; on disk too with --history-dir
+scheduler = None # call_later(delay, fn, *args) provider, set by the engine
+bus = None # RoomBus in a sharded worker, None in a single process server
+worker_id = None
+
+# --- Metrics (see metrics.py, served with --metrics-port) ---
+# Anything else is counted as OTHER, so clients can't invent label values
+COUNTED_COMMANDS = frozenset(OPCODE_OF) | {'COMPRESSION_STATS', 'PROFILE'}
+METRICS.describe('nethub_connections_total', 'counter', "Accepted connections")
+METRICS.describe('nethub_connections_open', 'gauge', "Open connections")
+METRICS.describe('nethub_logins_total', 'counter', "LOGIN attempts, by result")
+METRICS.describe('nethub_commands_total', 'counter', "Commands received, by command")
+METRICS.describe('nethub_bytes_received_total', 'counter', "Bytes read from client sockets")
+METRICS.describe('nethub_broadcast_fanout', 'histogram', "Local recipients per broadcast, by kind")
+METRICS.describe('nethub_broadcast_seconds', 'histogram',
+                 "Time to queue a broadcast for every recipient, by kind (presence and game hold `lock`)")
+METRICS.describe('nethub_send_failures_total', 'counter', "Broadcast recipients dropped, by reason")
+METRICS.describe('nethub_uploads_total', 'counter', "Finished uploads, by result")
+METRICS.describe('nethub_upload_seconds', 'histogram', "UPLOAD_START to UPLOAD_END")
+METRICS.describe('nethub_downloads_total', 'counter', "Downloads started, by kind")
+METRICS.track('nethub_sessions', lambda: len(clients), "Logged in connections")
+METRICS.track('nethub_rooms', lambda: len(rooms), "Rooms with members")
+for _field in compression.CompressionStats.FIELDS:
+    METRICS.track(f'nethub_compression_{_field}', lambda f=_field: compression.STATS.snapshot()[f],
+                  "Deflate counters (see compression.py)", 'counter')
+
+def _observe_broadcast(kind, fanout, started):
+    METRICS.observe('nethub_broadcast_fanout', fanout, SIZE_BUCKETS, kind=kind)
+    METRICS.observe('nethub_broadcast_seconds', time.perf_counter() - started, kind=kind)
+
+def _user_entry(data):
+    # Admin format: "username#IP:Port" (Using # to avoid pipe conflict)
+    addr = data.get('addr', ('?', '?'))
+    return f"{data.get('username', 'Unknown')}#{addr[0]}:{addr[1]}"
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind((HOST, PORT))
-server.listen()
+def _describe(names, verb):
+    # "a joined", "a, b, c and d joined", "a, b, c and 5 others joined"
+    if len(names) == 1:
+        who = names[0]
+    elif len(names) <= 4:
+        who = ", ".join(names[:-1]) + f" and {names[-1]}"
+    else:
+        who = ", ".join(names[:3]) + f" and {len(names) - 3} others"
+    return f"{who} {verb} the room."
+
+def _schedule_presence(name, r):
+    # Caller must hold `lock`. Joins/leaves within PRESENCE_WINDOW are
+    # announced together by one flush per room.
+    if r.flush_pending:
+        return
+    r.flush_pending = True
+    if PRESENCE_WINDOW <= 0 or scheduler is None:
+        _flush_presence(name, r)
+    else:
+        scheduler.call_later(PRESENCE_WINDOW, flush_presence, name, r)
 
-def broadcast_to_room(room, message):
+def flush_presence(name, r):
     with lock:
-        to_remove = []
-        for client_sock, data in clients.items():
-            if data.get('room') == room:
-                try:
-                    client_sock.send((message + "\n").encode('utf-8'))
-                except:
-                    to_remove.append(client_sock)
-        
-        for sock in to_remove:
-            # We don't call remove_client here to avoid recursion loop, just close
+        _flush_presence(name, r)
+
+def _flush_presence(name, r):
+    # Caller must hold `lock`. Diffs current members against the last
+    # announcement: joiners get a full snapshot, everyone else one delta,
+    # and the room gets one aggregated SERVER notice. Pushes only enqueue,
+    # so doing this under the lock keeps versions in order.
+    r.flush_pending = False
+    if rooms.get(name) is not r:
+        return # Room emptied meanwhile, nobody left to tell
+
+    local = {c: (clients[c]['username'], _user_entry(clients[c])) for c in r.members if c in clients}
+    if bus is not None:
+        shared = tuple(sorted(entry for _, entry in local.values()))
+        if shared != r.shared:
+            r.shared = shared
+            bus.publish_members(name, shared)
+    current = dict(local)
+    for entries in r.remote.values():
+        current.update(entries)
+
+    joined = {c for c in current if c not in r.published}
+    left = [c for c in r.published if c not in current]
+    if not joined and not left:
+        return
+
+    r.version += 1
+    version = str(r.version)
+    fields, admin_fields = [version], [version]
+    if joined:
+        fields += ["JOIN", ",".join(current[c][0] for c in joined)]
+        admin_fields += ["JOIN", ",".join(current[c][1] for c in joined)]
+    if left:
+        fields += ["LEAVE", ",".join(r.published[c][0] for c in left)]
+        admin_fields += ["LEAVE", ",".join(r.published[c][1] for c in left)]
+    simple = Packet("PRESENCE", *fields)
+    admin = Packet("PRESENCE_ADMIN", *admin_fields)
+
+    # A user who left and came back within the window just reconnected
+    joined_set = {current[c][0] for c in joined}
+    left_set = {r.published[c][0] for c in left}
+    joined_names = sorted(joined_set - left_set)
+    left_names = sorted(left_set - joined_set)
+    notices = []
+    if joined_names:
+        notices.append(Packet("SERVER", _describe(joined_names, "joined")))
+    if left_names:
+        notices.append(Packet("SERVER", _describe(left_names, "left")))
+
+    r.published = current
+    # Joiners get the snapshot, built and encoded once for all of them. With
+    # --slow-consumer coalesce it also replaces deltas still queued for a
+    # client (see connections.py)
+    snapshots = _user_lists(r)
+    key = ('presence', name)
+    started = time.perf_counter()
+    for c in local:
+        try:
+            if c in joined:
+                c.send(snapshots[1] if clients[c].get('role') == 'admin' else snapshots[0])
+            elif clients[c].get('role') == 'admin':
+                c.push(admin, key, snapshots[1])
+            else:
+                c.push(simple, key, snapshots[0])
+            for notice in notices:
+                c.push(notice)
+        except:
+            METRICS.inc('nethub_send_failures_total', reason='closed')
+    _observe_broadcast('presence', len(local), started)
+
+def _room_join(client, room):
+    # Caller must hold `lock`
+    r = rooms.get(room)
+    if r is None:
+        r = rooms[room] = Room()
+    if client not in r.members:
+        r.members = r.members + (client,)
+    _schedule_presence(room, r)
+
+def _room_leave(client, room):
+    # Caller must hold `lock`
+    r = rooms.get(room)
+    if r is None or client not in r.members:
+        return
+    r.members = tuple(c for c in r.members if c is not client)
+    if not r.members and not r.remote:
+        del rooms[room]
+        if r.shared:
+            bus.publish_members(room, ())
+    else:
+        _schedule_presence(room, r)
+
+def _drop_clients(socks):
+    # We don't call remove_client here to avoid recursion loop, just close
+    with lock:
+        for sock in socks:
+            data = clients.pop(sock, None)
+            if data and data.get('room'):
+                _room_leave(sock, data['room'])
             try:
-                del clients[sock]
                 sock.close()
             except: pass
 
-def broadcast_user_list(room):
-    simple_list = []
-    admin_list = []
+def broadcast_to_room(room, packet):
+    if bus is not None:
+        bus.publish(room, packet)
+    _push_to_room(room, packet)
+
+def post_to_room(room, packet):
+    # Chat events late joiners should see: kept in the room history (by the
+    # hub in sharded mode), then broadcast
+    if bus is not None:
+        bus.publish(room, packet, record=True)
+    else:
+        _remember(room, packet)
+    _push_to_room(room, packet)
+
+def _remember(room, packet):
+    # History entries are text lines, whatever format the sender used
+    history.record(room, packet.data[:-1].decode('utf-8'))
+
+def _push_to_room(room, packet):
+    # Local members only
+    r = rooms.get(room)
+    if r is None:
+        return
+    
+    # Only enqueues on each client's outbound queue; writers do the actual I/O
+    to_remove = []
+    started = time.perf_counter()
+    members = r.members
+    for client_sock in members:
+        try:
+            if not client_sock.push(packet):
+                to_remove.append(client_sock)
+                METRICS.inc('nethub_send_failures_total', reason='slow')
+        except:
+            to_remove.append(client_sock)
+            METRICS.inc('nethub_send_failures_total', reason='closed')
+    _observe_broadcast('room', len(members), started)
     
+    if to_remove:
+        _drop_clients(to_remove)
+
+def play_game(client, user, room, action, args):
+    # The room's game is decided here (by the hub in sharded mode);
+    # clients only send what they'd like to play
+    if action == 'MOVE' and not (args and args[0].isdigit()):
+        return
+    if action in ('MOVE', 'RESET') and bus is not None:
+        # The outcome reaches our members as a GAME bus message, like everyone else's
+        bus.play(room, user, action, args[:1], lambda reason: _reject_move(client, reason))
+        return
+    reply = delta = None
     with lock:
-        # Collect data
-        temp_users = [] 
-        for c, v in clients.items():
-            if v['room'] == room:
-                username = v.get('username', 'Unknown')
-                addr = v.get('addr', ('?', '?'))
-                ip_info = f"{addr[0]}:{addr[1]}"
-                temp_users.append((username, ip_info))
-        
-        if not temp_users: return
+        r = rooms.get(room)
+        if r is None:
+            return
+        if action in ('MOVE', 'RESET'):
+            fields, reason = decide(r.game, user, action, args)
+            if fields:
+                delta = Packet(*fields)
+            else:
+                reply = Packet("GAME", "", "REJECT", reason)
+        elif action == 'STATE':
+            reply = Packet("GAME", "", "STATE", *r.game.snapshot())
+        # WIN and DRAW from older clients are ignored: the server decides
+        dropped = _send_game(r, delta) if delta else ()
+    if reply:
+        client.send(reply)
+    if dropped:
+        _drop_clients(dropped)
 
-        temp_users.sort(key=lambda x: x[0])
-        simple_list = [u[0] for u in temp_users]
-        # Admin format: "username#IP:Port" (Using # to avoid pipe conflict)
-        admin_list = [f"{u[0]}#{u[1]}" for u in temp_users] 
-        
-        print(f"DEBUG: Room {room} Users: {simple_list}")
+def _reject_move(client, reason):
+    try:
+        client.send(Packet("GAME", "", "REJECT", reason))
+    except ConnectionError:
+        pass # Left while the hub was deciding
 
-    simple_payload = "USERLIST|" + ",".join(simple_list)
-    admin_payload = "USERLIST_ADMIN|" + ",".join(admin_list)
+def _send_game(r, packet):
+    # Caller must hold `lock`, so deltas reach everyone in the order they were played
+    dropped = []
+    started = time.perf_counter()
+    for c in r.members:
+        try:
+            if not c.push(packet):
+                dropped.append(c)
+                METRICS.inc('nethub_send_failures_total', reason='slow')
+        except:
+            dropped.append(c)
+            METRICS.inc('nethub_send_failures_total', reason='closed')
+    _observe_broadcast('game', len(r.members), started)
+    return dropped
 
-    # Send appropriately
-    with lock:
-        for c, v in clients.items():
-            if v['room'] == room:
-                role = v.get('role', 'user')
-                try:
-                    if role == 'admin':
-                        c.send((admin_payload + "\n").encode('utf-8'))
-                    else:
-                        c.send((simple_payload + "\n").encode('utf-8'))
-                except:
-                    pass
+def send_user_list(client, room):
+    # Caller must hold `lock`. Full versioned snapshot for one client:
+    # USERLIST|u1,u2|version (old clients just read the list)
+    r = rooms.get(room)
+    data = clients.get(client)
+    if r is None or data is None:
+        return
+
+    simple, admin = _user_lists(r)
+    client.send(admin if data.get('role') == 'admin' else simple)
+
+def _user_lists(r):
+    # Caller must hold `lock`. (USERLIST, USERLIST_ADMIN) built from the last
+    # announcement, so they match `version`
+    temp_users = sorted(r.published.values())
+    version = str(r.version)
+    return (Packet("USERLIST", ",".join(u[0] for u in temp_users), version),
+            Packet("USERLIST_ADMIN", ",".join(u[1] for u in temp_users), version))
+
+def open_upload(size, expected, offset):
+    try:
+        return blobs.incoming(size, expected, offset), None
+    except ValueError as e:
+        return None, str(e)
+
+def start_upload(client, filename, user, room, result):
+    incoming, error = result
+    if error:
+        # Chunks that follow are read and dropped by the engine
+        client.send(Packet("UPLOAD_FAIL", filename, error))
+    else:
+        uploads[client] = {'file': incoming, 'name': filename, 'user': user, 'room': room,
+                           'started': time.perf_counter()}
 
 def remove_client(client):
-    username = None
-    room = None
+    upload = uploads.pop(client, None)
+    if upload:
+        # A resumable upload keeps its partial file for the reconnect
+        upload['file'].suspend()
+
     with lock:
         if client in clients:
-            username = clients[client].get('username')
             room = clients[client].get('room')
             del clients[client]
+            if room:
+                # The "left the room" notice goes out with the presence flush
+                _room_leave(client, room)
             client.close()
-    
-    if room and username:
-        broadcast_to_room(room, f"SERVER|{username} left the room.")
-        broadcast_user_list(room)
-
-# Buffer class
-class SocketBuffer:
-    def __init__(self, sock):
-        self.sock = sock
-        self.buffer = ""
-
-    def read_line(self):
-        while "\n" not in self.buffer:
-            try:
-                data = self.sock.recv(4096).decode('utf-8')
-                if not data:
-                    return None
-                self.buffer += data
-            except:
-                return None
+
+def finish_register(client, ok):
+    if ok:
+        client.send(REGISTER_SUCCESS)
+    else:
+        client.send(REGISTER_FAIL_TAKEN)
+
+def finish_login(client, addr, u, result, codecs=()):
+    success, role = result
+    METRICS.inc('nethub_logins_total', result='ok' if success else 'fail')
+    if success:
+        with lock:
+            # Re-login resets the session, so leave any previous room
+            old = clients.get(client)
+            if old and old.get('room'):
+                _room_leave(client, old['room'])
+            clients[client] = {'username': u, 'room': None, 'role': role, 'addr': addr}
+        if 'deflate' in codecs:
+            # LOGIN|user|pass|deflate: compress what we send from here on
+            client.send(Packet("LOGIN_SUCCESS", u, "deflate"))
+            if client.deflater is None:
+                client.use_compression()
+        else:
+            client.send(Packet("LOGIN_SUCCESS", u))
+    else:
+        client.send(LOGIN_FAIL_INVALID)
+
+def _is_admin(client):
+    with lock:
+        return client in clients and clients[client].get('role') == 'admin'
+
+def finish_upload(client, user, room, filename, sha256, size):
+    return register_file(filename, room, sha256, size, lambda: announce_upload(client, user, room, filename))
+
+def announce_upload(client, user, room, filename):
+    client.send(Packet("UPLOAD_OK", filename))
+    post_to_room(room, Packet("FILE_NOTIF", user, filename))
+
+def fetch_history(client, room, before_id, limit, backfill=False):
+    # In sharded mode the hub has the history: a (future, continuation) pair, like REGISTER
+    if bus is not None:
+        return (bus.request('HISTORY', room, before_id, limit),
+                lambda page: send_history(client, room, page, backfill))
+    send_history(client, room, history.page(room, before_id, limit), backfill)
+
+def send_history(client, room, page, backfill):
+    entries, more = page
+    if entries or not backfill:
+        client.send(history_frame(room, entries, more))
+
+def handle_command(client, addr, message, payload=None):
+    # Shared by both engines: `client` only needs send(Packet), send_stream() and close().
+    # `message` is a text line, or the already split fields from a binary frame.
+    # `payload` holds the raw bytes following a binary frame header (UPLOAD_CHUNK).
+    parts = message.split('|') if isinstance(message, str) else message
+    command = parts[0]
+    METRICS.inc('nethub_commands_total', command=command if command in COUNTED_COMMANDS else 'OTHER')
+
+    # Password hashing is slow by design, so REGISTER and LOGIN return a
+    # (future, continuation) pair; so do commands waiting for the hub in
+    # sharded mode, or for slow file work. The engine waits for the future
+    # without reading this client's next command, then calls continuation(result).
+    if command == 'REGISTER':
+        if len(parts) >= 3 and not valid_name(parts[1]):
+            client.send(REGISTER_FAIL_INVALID)
+        elif len(parts) >= 3:
+            u = parts[1]
+            p = parts[2]
+            return passwords.submit(register_user, u, p), lambda ok: finish_register(client, ok)
+
+    elif command == 'LOGIN':
+        if len(parts) >= 3:
+            u = parts[1]
+            p = parts[2]
+            codecs = parts[3].split(',') if len(parts) >= 4 else ()
+            return passwords.submit(login_user, u, p), lambda result: finish_login(client, addr, u, result, codecs)
+
+    elif command == 'PROTOCOL':
+        # PROTOCOL|binary: answered in text, then only binary frames both ways
+        if len(parts) >= 2 and parts[1] == 'binary':
+            client.send(PROTOCOL_BINARY)
+            client.use_binary()
+        else:
+            client.send(PROTOCOL_TEXT)
+
+    elif command == 'COMPRESSION_STATS':
+        # Admins only: process-wide deflate byte and CPU counters
+        if _is_admin(client):
+            stats = compression.STATS.snapshot()
+            client.send(Packet("COMPRESSION_STATS", *(f"{k}={round(v, 3)}" for k, v in stats.items())))
+
+    elif command == 'PROFILE':
+        # Admins only: PROFILE|start[|seconds] and PROFILE|stop, for this process
+        if _is_admin(client) and len(parts) >= 2:
+            if parts[1] == 'start':
+                seconds = int(parts[2]) if len(parts) >= 3 and parts[2].isdigit() else None
+                client.send(Packet("PROFILE", "started" if profiling.start(seconds) else "running"))
+            elif parts[1] == 'stop':
+                path = profiling.stop()
+                client.send(Packet("PROFILE", "saved", path) if path else Packet("PROFILE", "idle"))
+
+    elif command == 'JOIN_ROOM':
+        if len(parts) >= 2 and not valid_name(parts[1]):
+            client.send(INVALID_ROOM)
+        elif len(parts) >= 2:
+            room_name = parts[1]
+            joined = False
+            with lock:
+                if client in clients:
+                    data = clients[client]
+                    old_room = data['room']
+                    if old_room and old_room != room_name:
+                        _room_leave(client, old_room)
+                    data['room'] = room_name
+                    # The user list snapshot and "joined the room" notice
+                    # follow with the room's next presence flush
+                    client.send(Packet("ROOM_JOINED", room_name))
+                    _room_join(client, room_name)
+                    joined = True
+                    game = rooms[room_name].game
+                    if game.in_progress:
+                        # Late joiners get the board in one message
+                        client.send(Packet("GAME", "", "STATE", *game.snapshot()))
+            if joined:
+                # Backfill: the last messages in one frame
+                return fetch_history(client, room_name, None, BACKFILL_COUNT, backfill=True)
+
+    elif command == 'HISTORY_BEFORE':
+        # Paging further back: HISTORY_BEFORE|id
+        if len(parts) >= 2 and parts[1].isdigit():
+            room = None
+            with lock:
+                if client in clients:
+                    room = clients[client]['room']
+            if room:
+                return fetch_history(client, room, int(parts[1]), PAGE_SIZE)
+
+    elif command == 'USERLIST':
+        # Resync request from a client that missed a presence delta
+        with lock:
+            if client in clients and clients[client]['room']:
+                send_user_list(client, clients[client]['room'])
+
+    elif command == 'MSG':
+        if len(parts) >= 2:
+            content = parts[1]
+            user, room = "", ""
+            with lock:
+                if client in clients:
+                    user = clients[client]['username']
+                    room = clients[client]['room']
+            
+            if room:
+                post_to_room(room, Packet("MSG", user, content))
+
+    elif command == 'GAME':
+        # GAME|MOVE|cell, GAME|RESET or GAME|STATE (see game_engine.py)
+        user, room = "", ""
+        with lock:
+            if client in clients:
+                user = clients[client]['username']
+                room = clients[client]['room']
         
-        line, self.buffer = self.buffer.split("\n", 1)
-        return line
+        if room and len(parts) >= 2:
+            play_game(client, user, room, parts[1], parts[2:])
+
+    elif command == 'UPLOAD':
+        if len(parts) >= 3:
+            filename = os.path.basename(parts[1])
+            file_data = parts[2]
+            
+            user, room = "", ""
+            with lock:
+                if client in clients:
+                    user = clients[client]['username']
+                    room = clients[client]['room']
+
+            if not room:
+                client.send(Packet("UPLOAD_FAIL", filename, "Join a room first"))
+            elif not filename:
+                client.send(Packet("UPLOAD_FAIL", filename, "No file name"))
+            else:
+                data = base64.b64decode(file_data)
+                blob = blobs.incoming(len(data))
+                blob.write(data)
+                return register_file(filename, room, blob.finish(), len(data),
+                                     lambda: post_to_room(room, Packet("FILE_NOTIF", user, filename)))
+
+    elif command == 'DOWNLOAD':
+        if len(parts) >= 2:
+            filename = os.path.basename(parts[1])
+            user_room = None
+            with lock:
+                if client in clients:
+                    user_room = clients[client].get('room')
+
+            info = file_registry.lookup(filename, user_room) if user_room else None
+            if info and info['size'] > MAX_BASE64_FILE_SIZE:
+                # Its FILE_DATA line would be more than any client reads as one line
+                client.send(TOO_LARGE_FOR_DOWNLOAD)
+            elif info:
+                filepath = blobs.path(info['sha256'])
+                if os.path.exists(filepath):
+                    METRICS.inc('nethub_downloads_total', kind='base64')
+                    with open(filepath, "rb") as f:
+                        b64_data = base64.b64encode(f.read()).decode('utf-8')
+                        client.send(Packet("FILE_DATA", filename, b64_data))
+            else:
+                 client.send(ACCESS_DENIED)
+
+    elif command == 'LIST_FILES':
+        user_room = None
+        with lock:
+            if client in clients:
+                user_room = clients[client].get('room')
+        if user_room:
+            # Filenames never contain '/', so it is a safe separator
+            client.send(Packet("FILE_LIST", "/".join(file_registry.files_in_room(user_room))))
+
+    # --- Chunked transfers (see file_transfer.py) ---
+    elif command == 'UPLOAD_PROBE':
+        # Hash first: content the server already has is shared without sending it again
+        if len(parts) >= 4:
+            filename = os.path.basename(parts[1])
+            size, sha256 = int(parts[2]), parts[3]
+            user, room = "", ""
+            with lock:
+                if client in clients:
+                    user = clients[client]['username']
+                    room = clients[client]['room']
+
+            if not (room and filename):
+                client.send(Packet("UPLOAD_FAIL", filename, "Join a room first"))
+            elif blobs.has(sha256, size):
+                return finish_upload(client, user, room, filename, sha256, size)
+            else:
+                # Resume from whatever an interrupted upload of this content left
+                client.send(Packet("UPLOAD_NEED", filename, str(blobs.partial_size(sha256))))
+
+    elif command == 'UPLOAD_START':
+        if len(parts) >= 3:
+            filename = os.path.basename(parts[1])
+            size = int(parts[2])
+            expected = parts[3] if len(parts) >= 4 else None
+            offset = int(parts[4]) if len(parts) >= 5 else 0
+
+            user, room = "", ""
+            with lock:
+                if client in clients:
+                    user = clients[client]['username']
+                    room = clients[client]['room']
+
+            old = uploads.pop(client, None)
+            if old:
+                old['file'].suspend()
+
+            if not (room and filename):
+                # Chunks that follow are read and dropped by the engine
+                client.send(Packet("UPLOAD_FAIL", filename, "Join a room first"))
+            elif offset:
+                # Resuming hashes the partial file so far: done on file_pool, like
+                # REGISTER on its pool, so the chunks that follow wait without blocking anyone
+                return (file_pool.submit(open_upload, size, expected, offset),
+                        lambda result: start_upload(client, filename, user, room, result))
+            else:
+                start_upload(client, filename, user, room, open_upload(size, expected, offset))
+
+    elif command == 'UPLOAD_CHUNK':
+        upload = uploads.get(client)
+        if upload and payload is not None:
+            try:
+                upload['file'].write(payload)
+            except ValueError as e:
+                # Taken over by a newer connection, or more data than announced
+                del uploads[client]
+                upload['file'].suspend()
+                client.send(Packet("UPLOAD_FAIL", upload['name'], str(e)))
+            else:
+                METRICS.inc('nethub_file_bytes_total', len(payload), direction='in')
+
+    elif command == 'UPLOAD_END':
+        upload = uploads.pop(client, None)
+        if upload:
+            try:
+                sha256 = upload['file'].finish()
+            except ValueError as e:
+                METRICS.inc('nethub_uploads_total', result='fail')
+                client.send(Packet("UPLOAD_FAIL", upload['name'], str(e)))
+            else:
+                METRICS.inc('nethub_uploads_total', result='ok')
+                METRICS.observe('nethub_upload_seconds', time.perf_counter() - upload['started'])
+                return finish_upload(client, upload['user'], upload['room'], upload['name'],
+                              sha256, upload['file'].size)
+
+    elif command == 'DOWNLOAD_STREAM':
+        if len(parts) >= 2:
+            filename = os.path.basename(parts[1])
+            user_room = None
+            with lock:
+                if client in clients:
+                    user_room = clients[client].get('room')
+
+            info = file_registry.lookup(filename, user_room) if user_room else None
+            filepath = blobs.path(info['sha256']) if info else None
+            if filepath and os.path.exists(filepath):
+                # DOWNLOAD_STREAM|name|offset|version resumes, if the file is still that version
+                # Not the whole hash, which would let anyone claim the file with UPLOAD_PROBE
+                version = info['sha256'][:16]
+                offset = 0
+                if len(parts) >= 4 and parts[3] == version:
+                    offset = max(0, int(parts[2]))
+                METRICS.inc('nethub_downloads_total', kind='resumed' if offset else 'stream')
+                # The writer sends it straight from disk with sendfile(), one chunk per frame
+                client.send_stream(iter_file_regions(filepath, filename, offset=offset, version=version))
+            else:
+                client.send(ACCESS_DENIED)
 
 def handle_client(client, addr):
-    buf = SocketBuffer(client)
+    buf = SocketBuffer(client.sock)
+    counted = 0
     
     try:
         while True:
-            message = buf.read_line()
-            if message is None:
+            # Every message that arrived in one recv(), binary payloads included
+            batch = buf.read_batch()
+            METRICS.inc('nethub_bytes_received_total', buf.received - counted)
+            counted = buf.received
+            if batch is None:
                 break
-            
-            parts = message.split('|')
-            command = parts[0]
-
-            if command == 'REGISTER':
-                if len(parts) >= 3:
-                    u = parts[1]
-                    p = parts[2]
-                    if register_user(u, p):
-                        client.send("REGISTER_SUCCESS\n".encode('utf-8'))
-                    else:
-                        client.send("REGISTER_FAIL|Username taken\n".encode('utf-8'))
-
-            elif command == 'LOGIN':
-                if len(parts) >= 3:
-                    u = parts[1]
-                    p = parts[2]
-                    success, role = login_user(u, p)
-                    if success:
-                        with lock:
-                            clients[client] = {'username': u, 'room': None, 'role': role, 'addr': addr}
-                        client.send(f"LOGIN_SUCCESS|{u}\n".encode('utf-8'))
-                    else:
-                        client.send("LOGIN_FAIL|Invalid credentials\n".encode('utf-8'))
-    
-            elif command == 'JOIN_ROOM':
-                if len(parts) >= 2:
-                    room_name = parts[1]
-                    username = ""
-                    with lock:
-                        if client in clients:
-                            clients[client]['room'] = room_name
-                            username = clients[client]['username']
-                    
-                    if username:
-                        client.send(f"ROOM_JOINED|{room_name}\n".encode('utf-8'))
-                        broadcast_to_room(room_name, f"SERVER|{username} joined the room.")
-                        broadcast_user_list(room_name)
-
-            elif command == 'MSG':
-                if len(parts) >= 2:
-                    content = parts[1]
-                    user, room = "", ""
-                    with lock:
-                        if client in clients:
-                            user = clients[client]['username']
-                            room = clients[client]['room']
-                    
-                    if room:
-                        msg_to_send = f"MSG|{user}|{content}"
-                        broadcast_to_room(room, msg_to_send)
-
-            elif command == 'GAME':
-                # Join all remaining parts to capture full payload
-                content = "|".join(parts[1:])
-                user, room = "", ""
-                with lock:
-                    if client in clients:
-                        user = clients[client]['username']
-                        room = clients[client]['room']
-                
-                if room:
-                    msg_to_send = f"GAME|{user}|{content}"
-                    broadcast_to_room(room, msg_to_send)
-
-            elif command == 'UPLOAD':
-                parts_upload = message.split('|', 3)
-                if len(parts_upload) >= 3:
-                    filename = parts_upload[1]
-                    file_data = parts_upload[2]
-                    
-                    user, room = "", ""
-                    with lock:
-                        if client in clients:
-                            user = clients[client]['username']
-                            room = clients[client]['room']
-
-                    if room:
-                        filepath = os.path.join(FILES_DIR, filename)
-                        register_file(filename, room)
-
-                        with open(filepath, "wb") as f:
-                            f.write(base64.b64decode(file_data))
-                        
-                        broadcast_to_room(room, f"FILE_NOTIF|{user}|{filename}")
-
-            elif command == 'DOWNLOAD':
-                if len(parts) >= 2:
-                    filename = parts[1]
-                    user_room = None
-                    with lock:
-                        if client in clients:
-                            user_room = clients[client].get('room')
-
-                    if user_room and can_access_file(filename, user_room):
-                        filepath = os.path.join(FILES_DIR, filename)
-                        if os.path.exists(filepath):
-                            with open(filepath, "rb") as f:
-                                b64_data = base64.b64encode(f.read()).decode('utf-8')
-                                client.send(f"FILE_DATA|{filename}|{b64_data}\n".encode('utf-8'))
-                    else:
-                         client.send(f"SERVER|Access Denied or File Not Found.\n".encode('utf-8'))
+            for message, payload in batch:
+                pending = handle_command(client, addr, message, payload)
+                if pending:
+                    future, then = pending
+                    then(future.result())
+            if client.binary and not isinstance(buf.framer, BinaryFramer):
+                # Negotiated with PROTOCOL|binary; the client waits for our answer
+                buf.framer = BinaryFramer.take_over(buf.framer)
 
     except Exception as e:
-        print(f"Error handling client: {e}")
+        log.info("Error handling client %s: %s", addr, e)
     
     remove_client(client)
+    client.close()
+    METRICS.inc('nethub_connections_open', -1)
+
+def print_banner(engine, workers=1):
+    if worker_id is not None:
+        log.info("Worker %s (pid %s) is serving %s:%s (%s engine)", worker_id, os.getpid(), HOST, PORT, engine)
+        return
+    mode = f"{engine} engine" if workers == 1 else f"{engine} engine, {workers} workers"
+    log.info("Server is listening on %s:%s (%s)", HOST, PORT, mode)
+    log.info("Files directory: %s", FILES_DIR)
+    log.info("Users file: %s", USERS_FILE)
+
+# --- Threaded Engine ---
+def create_server_socket():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if bus is not None:
+        # Every worker binds the port; the kernel spreads connections across them
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((HOST, PORT))
+    server.listen(LISTEN_BACKLOG)
+    return server
 
 def receive():
-    print(f"Server is listening on {HOST}:{PORT}")
-    print(f"Files directory: {FILES_DIR}")
-    print(f"Users file: {USERS_FILE}")
+    global scheduler
+    scheduler = ThreadScheduler()
+    if bus is not None:
+        bus.start()
+    server = create_server_socket()
+    if hasattr(signal, 'SIGUSR2'):
+        # kill -USR2 <pid> starts a profile, the next one saves it
+        signal.signal(signal.SIGUSR2, lambda signum, frame: profiling.toggle())
+    print_banner('threaded')
     
     while True:
         client, address = server.accept()
-        print(f"Connected with {str(address)}")
+        METRICS.inc('nethub_connections_total')
+        METRICS.inc('nethub_connections_open')
+        log.debug("Connected with %s", address)
         # Pass address to handle_client
-        thread = threading.Thread(target=handle_client, args=(client, address))
+        thread = threading.Thread(target=handle_client, args=(ThreadedClient(client), address))
         thread.start()
 
+# --- Asyncio Engine ---
+async def handle_async_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    METRICS.inc('nethub_connections_total')
+    METRICS.inc('nethub_connections_open')
+    log.debug("Connected with %s", addr)
+    client = AsyncClient(writer)
+    framer = LineFramer()
+
+    try:
+        while True:
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+            METRICS.inc('nethub_bytes_received_total', len(data))
+            framer.feed(data)
+            for message, payload in framer.messages():
+                pending = handle_command(client, addr, message, payload)
+                if pending:
+                    # Hashing runs on the pool; the loop keeps serving everyone else
+                    future, then = pending
+                    then(await asyncio.wrap_future(future))
+            if client.binary and not isinstance(framer, BinaryFramer):
+                framer = BinaryFramer.take_over(framer)
+    except Exception as e:
+        log.info("Error handling client %s: %s", addr, e)
+
+    remove_client(client)
+    client.close()
+    METRICS.inc('nethub_connections_open', -1)
+
+async def serve_async():
+    global scheduler
+    scheduler = asyncio.get_running_loop() # loop.call_later runs callbacks on the loop
+    if bus is not None:
+        # Bus messages touch clients and rooms, so handle them on the loop
+        bus.dispatch = scheduler.call_soon_threadsafe
+        bus.start()
+    server = await asyncio.start_server(handle_async_client, HOST, PORT,
+                                        backlog=LISTEN_BACKLOG, reuse_address=True,
+                                        reuse_port=bus is not None)
+    if hasattr(signal, 'SIGUSR2'):
+        scheduler.add_signal_handler(signal.SIGUSR2, profiling.toggle)
+    print_banner('asyncio')
+    async with server:
+        await server.serve_forever()
+
+def receive_async():
+    asyncio.run(serve_async())
+
+# --- Sharded Mode ---
+def handle_bus_message(message):
+    # A message from another worker (see room_bus.py)
+    kind, *args = message
+    if kind == 'PUB':
+        room, fields = args
+        _push_to_room(room, Packet(*fields))
+
+    elif kind == 'GAME':
+        # A move the hub has checked: apply it to our copy, tell our members
+        room, fields = args
+        packet = Packet(*fields)
+        with lock:
+            r = rooms.get(room)
+            if r is None:
+                return
+            _, user, action, *args = packet.fields
+            if action == 'MOVE':
+                r.game.apply(user, int(args[0]), args[1])
+            elif action == 'RESET':
+                r.game.reset()
+            dropped = _send_game(r, packet)
+        if dropped:
+            _drop_clients(dropped)
+
+    elif kind == 'MEMBERS':
+        room, worker, entries = args
+        with lock:
+            r = rooms.get(room)
+            if r is None:
+                if not entries:
+                    return
+                r = rooms[room] = Room()
+            if entries:
+                r.remote[worker] = {(worker, e): (e.rsplit('#', 1)[0], e) for e in entries}
+            else:
+                r.remote.pop(worker, None)
+            if not r.members and not r.remote:
+                del rooms[room]
+            else:
+                _schedule_presence(room, r)
+
+    elif kind == 'GONE':
+        with lock:
+            for room, r in list(rooms.items()):
+                if r.remote.pop(args[0], None) is not None:
+                    if not r.members and not r.remote:
+                        del rooms[room]
+                    else:
+                        _schedule_presence(room, r)
+
+def run_worker(index, engine, metrics_port=None):
+    global bus, worker_id
+    worker_id = index
+    if metrics_port:
+        metrics.serve(metrics_port + index)
+    bus = RoomBus(BUS_PATH, index, handle_bus_message, stores)
+    # Without the parent we would drift apart from the other workers
+    bus.on_lost = lambda: os._exit(1)
+    # Only the parent writes users.json and files_metadata.json
+    for name, store in stores.items():
+        store.replicate(lambda method, args, name=name: bus.call(name, method, args))
+    if engine == 'asyncio':
+        receive_async()
+    else:
+        receive()
+
+def serve_sharded(workers, engine, metrics_port=None):
+    # Fork before any thread exists; the parent only runs the bus and persistence
+    hub = BusHub(BUS_PATH, stores, history)
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            hub.server.close()
+            try:
+                run_worker(index, engine, metrics_port)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    # terminate() should take the workers down with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # Profiling is per process: pass it on to every worker
+    signal.signal(signal.SIGUSR2, lambda signum, frame: [os.kill(pid, signal.SIGUSR2) for pid in children])
+    hub.start()
+    for store in stores.values():
+        store.start()
+    print_banner(engine, workers)
+    try:
+        for _ in children:
+            pid, status = os.wait()
+            log.warning("Worker process %s exited (%s)", pid, status)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        hub.close()
+
+def prepare_files():
+    # Before any worker or client thread exists: nothing is uploading yet.
+    # file_registry loaded cleanly, or the server would have stopped at startup
+    file_registry.adopt_legacy(FILES_DIR)
+    removed = blobs.sweep(file_registry.live_blobs())
+    if removed:
+        log.info("Removed %s unreferenced blob(s)", removed)
+
+def main():
+    global HOST, PORT, PRESENCE_WINDOW, history
+    parser = argparse.ArgumentParser(description="NetHub chat server")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="threaded: one thread per client, asyncio: single event loop")
+    parser.add_argument('--slow-consumer', choices=connections.SLOW_CONSUMER_POLICIES,
+                        default=connections.SLOW_CONSUMER_POLICY,
+                        help="what to do when a client's outbound queue is full")
+    parser.add_argument('--queue-size', type=int, default=connections.OUTBOUND_QUEUE_SIZE,
+                        help="max queued broadcast messages per client")
+    parser.add_argument('--presence-window', type=float, default=PRESENCE_WINDOW,
+                        help="seconds to batch joins/leaves per room (0 = announce immediately)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes sharing the port (needs fork and SO_REUSEPORT)")
+    parser.add_argument('--history-dir', default=None,
+                        help="also keep room history in segment files under this directory")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics "
+                             "(with --workers, worker i uses PORT + i)")
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--profile-locks', action='store_true',
+                        help="always record lock wait/hold times per call site, not only while profiling")
+    args = parser.parse_args()
+    if args.workers > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        parser.error("--workers needs fork() and SO_REUSEPORT (Linux, BSD, macOS)")
+
+    logs.setup(args.log_level)
+    profiling.LOCK_STATS = args.profile_locks
+    HOST, PORT = args.host, args.port
+    PRESENCE_WINDOW = args.presence_window
+    connections.SLOW_CONSUMER_POLICY = args.slow_consumer
+    connections.OUTBOUND_QUEUE_SIZE = args.queue_size
+    if args.history_dir:
+        history = RoomHistory(args.history_dir)
+
+    try:
+        prepare_files()
+        if args.workers > 1:
+            serve_sharded(args.workers, args.engine, args.metrics_port)
+            return
+        if args.metrics_port:
+            metrics.serve(args.metrics_port)
+        user_store.start()
+        file_registry.start()
+        if args.engine == 'asyncio':
+            receive_async()
+        else:
+            receive()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        user_store.close()
+        file_registry.close()
+        history.close()
+
 if __name__ == "__main__":
-    receive()
+    main()
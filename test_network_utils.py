@@ -0,0 +1,79 @@
+import unittest
+
+from compression import Deflater
+from network_utils import LineFramer, LineTooLong, MAX_CHUNK_SIZE
+from protocol import deflate_frame
+
+
+class LineFramerTest(unittest.TestCase):
+    def test_lines_and_payloads_split_at_every_byte(self):
+        data = "MSG|héllo wörld\n".encode('utf-8') + b"UPLOAD_CHUNK|3\nabcMSG|x\n"
+        framer = LineFramer()
+        got = []
+        for i in range(len(data)):
+            framer.feed(data[i:i + 1])
+            got.extend(framer.messages())
+        self.assertEqual(got, [("MSG|héllo wörld", None),
+                               ("UPLOAD_CHUNK|3", b"abc"),
+                               ("MSG|x", None)])
+
+    def test_multibyte_character_split_across_feeds(self):
+        data = "MSG|€\n".encode('utf-8')
+        cut = data.index(b"\xe2") + 1
+        framer = LineFramer()
+        framer.feed(data[:cut])
+        self.assertEqual(framer.messages(), [])
+        framer.feed(data[cut:])
+        self.assertEqual(framer.messages(), [("MSG|€", None)])
+
+    def test_payload_may_contain_newlines(self):
+        framer = LineFramer()
+        framer.feed(b"FILE_CHUNK|4\n\n\n\n\nMSG|after\n")
+        self.assertEqual(framer.messages(), [("FILE_CHUNK|4", b"\n\n\n\n"),
+                                             ("MSG|after", None)])
+
+    def test_line_without_newline_is_too_long(self):
+        framer = LineFramer(max_line=16)
+        framer.feed(b"x" * 16)
+        self.assertEqual(framer.messages(), [])
+        framer.feed(b"x")
+        with self.assertRaises(LineTooLong):
+            framer.messages()
+
+    def test_long_line_within_limit_is_kept(self):
+        framer = LineFramer(max_line=16)
+        framer.feed(b"y" * 10)
+        framer.feed(b"y" * 6 + b"\n")
+        self.assertEqual(framer.messages(), [("y" * 16, None)])
+
+    def test_oversized_chunk_is_rejected(self):
+        framer = LineFramer()
+        framer.feed(f"UPLOAD_CHUNK|{MAX_CHUNK_SIZE + 1}\n".encode())
+        with self.assertRaises(ValueError):
+            framer.messages()
+
+    def test_message_spans_consecutive_deflate_frames(self):
+        text = "".join(f"MSG|line {i}\n" for i in range(200)).encode()
+        pieces = Deflater().compress(text)
+        # Cut the compressed stream mid-message, as a big write would be
+        half = len(pieces[0]) // 2
+        wire = b"".join(deflate_frame(p) for p in (pieces[0][:half], pieces[0][half:]))
+        wire += b"MSG|plain\n"
+
+        framer = LineFramer()
+        framer.feed(wire)
+        got = framer.messages()
+        self.assertEqual(got[:-1], [(f"MSG|line {i}", None) for i in range(200)])
+        self.assertEqual(got[-1], ("MSG|plain", None))
+
+    def test_deflate_stream_continues_between_frames(self):
+        deflater = Deflater()
+        framer = LineFramer()
+        for word in ("first", "second", "first"):
+            for piece in deflater.compress(f"MSG|{word}\n".encode()):
+                framer.feed(deflate_frame(piece))
+            self.assertEqual(framer.messages(), [(f"MSG|{word}", None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from user_store import UserStore
+
+
+class JournalReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'users.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def reopen(self, store):
+        # A crash: the journal is left as is, no snapshot
+        store.journal.close()
+        return UserStore(self.path)
+
+    def test_torn_entry_is_cut_off_before_appending(self):
+        store = UserStore(self.path)
+        self.assertTrue(store.add('a', {'role': 'user'}))
+        store.journal.write('{"key": "b", "val')
+        store.journal.flush()
+
+        store = self.reopen(store)
+        self.assertEqual(store.get('b'), None)
+        self.assertTrue(store.add('c', {'role': 'user'}))
+
+        store = self.reopen(store)
+        self.assertEqual(store.get('a'), {'role': 'user'})
+        self.assertEqual(store.get('c'), {'role': 'user'})
+        store.close()
+
+    def test_corrupt_json_file_refuses_to_load(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('{ broken')
+        with self.assertLogs('persistence', 'ERROR'):
+            with self.assertRaises(ValueError):
+                UserStore(self.path)
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '{ broken') # Left alone for someone to look at
+
+    def test_interrupted_snapshot_is_finished_at_load(self):
+        store = UserStore(self.path)
+        store.add('a', {'role': 'user'})
+        store.journal.close()
+        # Crash after the journal was rotated, before the JSON file was written
+        os.replace(store.journal_path, store.journal_path + '.old')
+
+        store = UserStore(self.path)
+        self.assertFalse(os.path.exists(store.journal_path + '.old'))
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'a': {'role': 'user'}})
+        store.add('b', {'role': 'user'})
+        # Another crash, in the middle of the next snapshot
+        store.journal.close()
+        os.replace(store.journal_path, store.journal_path + '.old')
+
+        store = UserStore(self.path)
+        self.assertEqual(store.get('a'), {'role': 'user'})
+        self.assertEqual(store.get('b'), {'role': 'user'})
+        store.close()
+
+    def test_snapshot_then_replay(self):
+        store = UserStore(self.path)
+        store.add('a', {'role': 'user'})
+        store.close()
+        with open(self.path, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'a': {'role': 'user'}})
+        store = UserStore(self.path)
+        store.update('a', {'role': 'admin'})
+        store = self.reopen(store)
+        self.assertEqual(store.get('a'), {'role': 'admin'})
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import struct
+import unittest
+
+from compression import Deflater
+from network_utils import LineFramer
+from protocol import (BinaryFramer, deflate_frame, decode_messages, encode_frame,
+                      encode_message)
+
+
+def frame(*messages):
+    return encode_frame([encode_message(*m) for m in messages])
+
+
+class DecodeMessagesTest(unittest.TestCase):
+    def test_several_messages_in_one_frame(self):
+        body = b"".join([encode_message(("MSG", "a|b", "line\nbreak")),
+                         encode_message(("FILE_CHUNK", "x.txt"), b"\x00\xff"),
+                         encode_message(("NOT_AN_OPCODE", "é"))])
+        self.assertEqual(decode_messages(body), [
+            (["MSG", "a|b", "line\nbreak"], None),
+            (["FILE_CHUNK", "x.txt"], b"\x00\xff"),
+            (["NOT_AN_OPCODE", "é"], None),
+        ])
+
+    def test_empty_body(self):
+        self.assertEqual(decode_messages(b""), [])
+
+    def test_field_running_past_the_frame(self):
+        body = encode_message(("MSG", "hello"))
+        with self.assertRaises(ValueError):
+            decode_messages(body[:-1])
+
+    def test_truncated_message_header(self):
+        body = encode_message(("MSG", "hello"))
+        for cut in (1, 3, 5):
+            with self.assertRaises(ValueError):
+                decode_messages(body[:cut])
+
+    def test_unknown_opcode(self):
+        with self.assertRaises(ValueError):
+            decode_messages(struct.pack('>BB', 255, 0))
+
+
+class BinaryFramerTest(unittest.TestCase):
+    def test_frames_split_at_every_byte(self):
+        data = frame((("MSG", "€uro"),), (("UPLOAD_CHUNK",), b"abc")) + frame((("GAME", "X"),))
+        framer = BinaryFramer()
+        got = []
+        for i in range(len(data)):
+            framer.feed(data[i:i + 1])
+            got.extend(framer.messages())
+        self.assertEqual(got, [(["MSG", "€uro"], None),
+                               (["UPLOAD_CHUNK"], b"abc"),
+                               (["GAME", "X"], None)])
+
+    def test_truncated_frame_waits_for_more(self):
+        data = frame((("MSG", "hi"),))
+        framer = BinaryFramer()
+        framer.feed(data[:-1])
+        self.assertEqual(framer.messages(), [])
+        framer.feed(data[-1:])
+        self.assertEqual(framer.messages(), [(["MSG", "hi"], None)])
+
+    def test_oversized_frame_is_rejected(self):
+        framer = BinaryFramer(max_frame=64)
+        framer.feed(struct.pack('>I', 65))
+        with self.assertRaises(ValueError):
+            framer.messages()
+
+    def test_message_spans_consecutive_deflate_frames(self):
+        inner = frame(*[(("MSG", f"line {i}"),) for i in range(200)])
+        pieces = Deflater().compress(inner)
+        half = len(pieces[0]) // 2
+        wire = b"".join(deflate_frame(p, binary=True) for p in (pieces[0][:half], pieces[0][half:]))
+        wire += frame((("MSG", "plain"),))
+
+        framer = BinaryFramer()
+        framer.feed(wire)
+        got = framer.messages()
+        self.assertEqual(got[:-1], [(["MSG", f"line {i}"], None) for i in range(200)])
+        self.assertEqual(got[-1], (["MSG", "plain"], None))
+
+    def test_take_over_keeps_buffered_bytes(self):
+        # The binary client may send frames right behind PROTOCOL|binary
+        after = frame((("MSG", "first"),), (("GAME", "X"),))
+        text = LineFramer()
+        text.feed(b"PROTOCOL|binary\n" + after[:7])
+        self.assertEqual(text.next_message(), ("PROTOCOL|binary", None))
+
+        framer = BinaryFramer.take_over(text)
+        framer.feed(after[7:])
+        self.assertEqual(framer.messages(), [(["MSG", "first"], None), (["GAME", "X"], None)])
+
+    def test_take_over_keeps_the_deflate_stream(self):
+        deflater = Deflater()
+        text = LineFramer()
+        for piece in deflater.compress(b"MSG|" + b"x" * 300 + b"\n"):
+            text.feed(deflate_frame(piece))
+        text.feed(b"PROTOCOL|binary\n")
+        self.assertEqual([m[0][:5] for m in text.messages()], ["MSG|x", "PROTO"])
+
+        framer = BinaryFramer.take_over(text)
+        for piece in deflater.compress(frame((("MSG", "x" * 300),))):
+            framer.feed(deflate_frame(piece, binary=True))
+        self.assertEqual(framer.messages(), [(["MSG", "x" * 300], None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext
 from config import COLORS, FONT_MAIN, FONT_BOLD
 
+FILE_LINK_PREFIX = "📄 "
+
 class NetHubUI:
     def __init__(self, root):
         self.root = root
@@ -88,7 +90,7 @@ class NetHubUI:
                   bg=COLORS["success"], fg="white", activebackground="#1e824c", activeforeground="white",
                   font=("Segoe UI", 12, "bold"), relief="flat", cursor="hand2").pack(fill="x", ipady=10, pady=40)
 
-    def create_chat_frame(self, parent, on_speed, on_game, on_upload, on_send, on_emoji):
+    def create_chat_frame(self, parent, on_speed, on_game, on_upload, on_send, on_emoji, on_file):
         header_frame = tk.Frame(parent, bg=COLORS["bg_dark"], height=55, padx=15)
         header_frame.pack(fill="x")
         header_frame.pack_propagate(False)
@@ -136,6 +138,13 @@ class NetHubUI:
         self.chat_area.tag_config("bubble", lmargin1=10, lmargin2=10, rmargin=10)
         self.chat_area.tag_config("system", foreground=COLORS["warning"], justify="center", spacing1=10, spacing3=10)
 
+        # Shared files are plain text with one tag, not a Button each; the click finds the name
+        self.chat_area.tag_config("file_link", foreground=COLORS["primary"], background=COLORS["bg_dark"],
+                                  font=("Segoe UI", 10), underline=True)
+        self.chat_area.tag_bind("file_link", "<Enter>", lambda e: self.chat_area.config(cursor="hand2"))
+        self.chat_area.tag_bind("file_link", "<Leave>", lambda e: self.chat_area.config(cursor="xterm"))
+        self.chat_area.tag_bind("file_link", "<Button-1>", lambda e: on_file(self.file_link_at(e.x, e.y)))
+
         # Input Area
         input_container = tk.Frame(parent, bg=COLORS["bg_dark"], pady=15, padx=15)
         input_container.pack(fill="x")
@@ -153,3 +162,29 @@ class NetHubUI:
         tk.Button(input_container, text="➤", command=on_send, 
                   bg=COLORS["primary"], fg="white", activebackground=COLORS["primary_hover"], 
                   font=("Arial", 12, "bold"), relief="flat", bd=0, cursor="hand2").pack(side="right", ipady=3, ipadx=10)
+
+    # --- Chat Area ---
+    def insert_file_link(self, at, filename):
+        self.chat_area.insert(at, FILE_LINK_PREFIX + filename, "file_link")
+
+    def file_link_at(self, x, y):
+        # Filename of the link under the mouse
+        start, end = self.chat_area.tag_prevrange("file_link", f"@{x},{y} + 1c")
+        return self.chat_area.get(start, end)[len(FILE_LINK_PREFIX):]
+
+    def trim_chat(self, max_lines):
+        """Drop the oldest lines beyond max_lines (chat_area must be editable).
+
+        Cuts at the blank line starting a message, so no message is left half
+        shown. Returns True if anything was dropped.
+        """
+        excess = int(self.chat_area.index('end-1c').split('.')[0]) - max_lines
+        if excess <= 0:
+            return False
+        cut = self.chat_area.search(r'^$', f"{excess + 1}.0", stopindex='end', regexp=True) or 'end-1c'
+        # Embedded widgets aren't freed with their text
+        for _, name, _ in self.chat_area.dump('1.0', cut, window=True):
+            if name:
+                self.chat_area.nametowidget(name).destroy()
+        self.chat_area.delete('1.0', cut)
+        return True
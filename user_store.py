@@ -0,0 +1,19 @@
+from persistence import JournaledStore, writer
+
+
+class UserStore(JournaledStore):
+    """Users indexed by username, loaded once from users.json."""
+
+    @writer
+    def add(self, username, record):
+        # Atomic check-and-insert: concurrent registrations can't overwrite each other
+        with self.lock:
+            if username in self.data:
+                return False
+            self._set(username, record)
+            return True
+
+    @writer
+    def update(self, username, record):
+        with self.lock:
+            self._set(username, record)